@@ -23,7 +23,8 @@ try:
     from downloaders.arxiv import ArxivDownloader
     from downloaders.mdpi import MdpiDownloader
     from downloaders.acl import AclDownloader
-    from downloaders.utils import sanitize_filename
+    from downloaders.utils import sanitize_filename, ensure_dir, forget_dirs
+    from downloaders import http_client
     from doi_mapping import get_editor_from_doi
 except ImportError as e:
     print("="*60)
@@ -34,6 +35,23 @@ except ImportError as e:
 
 # Configuration
 MAX_CONCURRENT_DOWNLOADS = 5
+_QUERY_UNSAFE_RE = re.compile(r'[^\w\s-]')
+_QUERY_SEP_RE = re.compile(r'[\s_]+')
+_EMPTY = ()
+_LIST_SEP = "; "
+INDEX_HEADER = ['doi', 'title', 'authors', 'keywords', 'editor', 'available_formats', 'path_folder', 'fulltext_quality']
+
+def _csv_escape(field) -> str:
+    """Quotes a CSV field only when needed (same output as csv.writer with QUOTE_MINIMAL)."""
+    if field is None:
+        return ''
+    s = field if isinstance(field, str) else str(field)
+    if ',' in s or '"' in s or '\n' in s or '\r' in s:
+        return '"' + s.replace('"', '""') + '"'
+    return s
+
+def _csv_row(fields) -> str:
+    return ",".join(map(_csv_escape, fields)) + "\r\n"
 
 class EnhancedFullTextDownloader:
     def __init__(self, csv_file: Optional[str] = None):
@@ -44,6 +62,10 @@ class EnhancedFullTextDownloader:
         self.stats = defaultdict(lambda: defaultdict(int))
         self.csv_lock = threading.Lock()
         self.query_index_files = {}
+        # query -> (article, formats) waiting to be written to that query's index
+        self._pending_index_rows: Dict[str, List[Tuple[Dict, List[str]]]] = defaultdict(list)
+        # index file path -> DOIs already listed in it (read from disk on first use)
+        self._indexed_dois: Dict[str, Set[str]] = {}
 
         self.dispatch_table = {
             "Elsevier": ElsevierDownloader(),
@@ -62,12 +84,10 @@ class EnhancedFullTextDownloader:
         return None
 
     def _sanitize_query_name(self, query: str) -> str:
-        safe_name = re.sub(r'[^\w\s-]', '', query).strip()
-        return re.sub(r'[\s_]+', '_', safe_name)
+        return _QUERY_SEP_RE.sub('_', _QUERY_UNSAFE_RE.sub('', query).strip())
         
     async def _search_orchestrator(self, keyword: str, publishers: List[str], year: Optional[int]):
-        connector = aiohttp.TCPConnector(limit=len(publishers) * 2, ssl=False)
-        async with aiohttp.ClientSession(connector=connector) as session:
+        async with http_client.shared_session() as session:
             tasks = [
                 asyncio.create_task(downloader.search(session, keyword, year))
                 for pub_name in publishers
@@ -96,34 +116,66 @@ class EnhancedFullTextDownloader:
     def _create_index_file(self, index_path: str):
         try:
             with open(index_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(['doi', 'title', 'authors', 'keywords', 'editor', 'available_formats', 'path_folder', 'fulltext_quality'])
+                f.write(_csv_row(INDEX_HEADER))
             print(f"📄 Created index file: {index_path}")
         except Exception as e:
             print(f"❌ Error creating index file {index_path}: {e}")
 
     def _append_to_index(self, query: str, article_data: Dict, available_formats: List[str]):
+        """Queues the index row; _flush_index formats and writes the queued rows together."""
+        self._pending_index_rows[query].append((article_data, available_formats))
+        if article_data.get('doi'):
+            self._get_indexed_dois(query).add(article_data['doi'])
+
+    def _get_indexed_dois(self, query: str) -> Set[str]:
+        """DOIs listed in the query's current index file (including rows still queued)."""
+        index_file = self.query_index_files.get(query)
+        indexed = self._indexed_dois.get(index_file)
+        if indexed is None:
+            indexed = self._indexed_dois[index_file] = set()
+            if index_file and os.path.exists(index_file):
+                try:
+                    with open(index_file, 'r', newline='', encoding='utf-8') as f:
+                        indexed.update(row['doi'] for row in csv.DictReader(f) if row.get('doi'))
+                except Exception as e:
+                    print(f"⚠️ Could not read index {index_file}: {e}")
+        return indexed
+
+    def _format_index_row(self, article_data: Dict, available_formats: List[str]) -> str:
+        editor = article_data.get('editor', 'N/A')
+        return _csv_row((
+            article_data.get('doi', 'N/A'),
+            article_data.get('title', 'N/A'),
+            _LIST_SEP.join(filter(None, article_data.get('authors') or _EMPTY)),
+            _LIST_SEP.join(filter(None, article_data.get('keywords') or _EMPTY)),
+            editor,
+            ';'.join(available_formats),
+            sanitize_filename(editor),
+            "full" if len(available_formats) >= 2 else "basic",
+        ))
+
+    def _flush_index(self, query: str):
+        pending = self._pending_index_rows.pop(query, None)
+        if not pending:
+            return
         index_file = self.query_index_files.get(query)
         if not index_file:
-            print(f"⚠️ Index file for query '{query}' not found. Cannot append.")
+            print(f"⚠️ Index file for query '{query}' not found. Cannot append {len(pending)} rows.")
             return
 
-        doi = article_data.get('doi', 'N/A')
-        title = article_data.get('title', 'N/A')
-        authors = '; '.join(article_data.get('authors', []))
-        keywords = '; '.join(article_data.get('keywords', []))
-        editor = article_data.get('editor', 'N/A')
-        path_folder = sanitize_filename(editor)
-        formats_str = ';'.join(available_formats)
-        quality = "full" if len(available_formats) >= 2 else "basic"
+        rows = []
+        for article_data, available_formats in pending:
+            try:
+                rows.append(self._format_index_row(article_data, available_formats))
+            except Exception as e:
+                print(f"  ❌ Error formatting index row for {article_data.get('doi', 'N/A')}: {e}")
         
         with self.csv_lock:
             try:
                 with open(index_file, 'a', newline='', encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    writer.writerow([doi, title, authors, keywords, editor, formats_str, path_folder, quality])
+                    f.write("".join(rows))
             except Exception as e:
-                print(f"  ❌ Error updating index for {doi}: {e}")
+                print(f"  ❌ Error updating index {index_file}: {e}")
 
     def _create_query_structure(self, query: str, publishers: Set[str], output_base_dir: str):
         query_dir_name = self._sanitize_query_name(query)
@@ -133,13 +185,17 @@ class EnhancedFullTextDownloader:
         self.query_index_files[query] = index_file_path
         
         if not os.path.exists(index_file_path):
-            os.makedirs(query_path, exist_ok=True)
+            # New query, or its folder was deleted during the session: nothing memoized under it still exists
+            self._indexed_dois.pop(index_file_path, None)
+            forget_dirs(query_path)
+            ensure_dir(query_path)
             self._create_index_file(index_file_path)
 
+        # Le sottocartelle pdf/xml/json vengono create dai downloader solo quando
+        # scrivono un file di quel formato; 'text' resta la cartella in cui
+        # article_parser cerca l'output OCR, quindi la prepariamo subito.
         for publisher in publishers:
-            publisher_dir_name = sanitize_filename(publisher)
-            for fmt in ['pdf', 'xml', 'json', 'text']:
-                os.makedirs(os.path.join(query_path, publisher_dir_name, fmt), exist_ok=True)
+            ensure_dir(os.path.join(query_path, sanitize_filename(publisher), 'text'))
         return query_path
 
     async def _download_article(self, session: aiohttp.ClientSession, article_info: Dict, query: str, query_path: str):
@@ -155,33 +211,68 @@ class EnhancedFullTextDownloader:
 
         publisher_dir_name = sanitize_filename(publisher)
         publisher_dir = os.path.join(query_path, publisher_dir_name)
+
+        # Already downloaded, in this session or by a previous run into the same folder
+        existing_formats = self._existing_formats(publisher_dir, doi)
+        if 'pdf' in existing_formats:
+            # A previous run may have been interrupted before its index rows were written
+            if doi not in self._get_indexed_dois(query):
+                self._append_to_index(query, article_info, existing_formats)
+            return doi, True, "already_on_disk"
             
         try:
             success, formats, reason = await downloader.download(session, doi, publisher_dir)
             if success:
                 self.stats[query][publisher] += 1
                 # --- PUNTO CHIAVE ---
-                # La scrittura sul file CSV avviene qui, subito dopo
-                # un download andato a buon fine, per ogni singolo articolo.
+                # La riga del CSV viene accodata qui, subito dopo un download
+                # andato a buon fine; _process_download_batch la scrive su file
+                # insieme alle altre (anche in caso di errore, nel finally).
                 self._append_to_index(query, article_info, formats)
             return doi, success, reason
         except Exception as e:
             return doi, False, f"error: {str(e)[:30]}"
 
+    def _existing_formats(self, publisher_dir: str, doi: str) -> List[str]:
+        """Formats of this DOI already saved under publisher_dir (standard <fmt>/<doi>.<fmt> layout)."""
+        file_stem = sanitize_filename(doi)
+        return [fmt for fmt in ('pdf', 'xml', 'json')
+                if os.path.exists(os.path.join(publisher_dir, fmt, f"{file_stem}.{fmt}"))]
+
     async def _process_download_batch(self, batch: List[Dict], query: str, query_path: str, progress_callback=None):
+        # The same paper can be selected more than once (e.g. matched via several publishers)
+        unique_batch, seen_dois = [], set()
+        for article in batch:
+            doi = article.get('doi')
+            if doi:
+                if doi in seen_dois:
+                    continue
+                seen_dois.add(doi)
+            unique_batch.append(article)
+        batch = unique_batch
         total_articles = len(batch)
-        processed_count = 0
+        pending = iter(batch)
+        results = []
         
-        connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_DOWNLOADS, ssl=False)
-        async with aiohttp.ClientSession(connector=connector) as session:
-            tasks = [self._download_article(session, article, query, query_path) for article in batch]
-            results = []
-            for future in asyncio.as_completed(tasks):
-                result = await future
-                processed_count += 1
-                if progress_callback:
-                    progress_callback(processed_count, total_articles, f"Downloading... {processed_count}/{total_articles}")
-                results.append(result)
+        async with http_client.shared_session() as session:
+            # A fixed pool of workers pulls articles from the shared iterator, so at most
+            # MAX_CONCURRENT_DOWNLOADS tasks exist at any time, whatever the batch size.
+            async def worker():
+                for article in pending:
+                    results.append(await self._download_article(session, article, query, query_path))
+                    if progress_callback:
+                        progress_callback(len(results), total_articles, f"Downloading... {len(results)}/{total_articles}")
+
+            num_workers = min(MAX_CONCURRENT_DOWNLOADS, total_articles)
+            try:
+                if hasattr(asyncio, "TaskGroup"):  # Python 3.11+
+                    async with asyncio.TaskGroup() as tg:
+                        for _ in range(num_workers):
+                            tg.create_task(worker())
+                else:
+                    await asyncio.gather(*(worker() for _ in range(num_workers)))
+            finally:
+                self._flush_index(query)
             return results
 
     def download_selected_articles(self, articles_to_download: List[Dict], query_name: str, output_base_dir: str, progress_callback=None) -> Dict:
@@ -0,0 +1,57 @@
+# downloaders/_doi_cache.py
+
+import functools
+import os
+from typing import Optional
+
+from .utils import CACHE_DIR
+
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+
+DOI_CACHE_DIR = os.path.join(CACHE_DIR, "doi")
+POSITIVE_TTL = 7 * 86400   # metadati trovati
+NEGATIVE_TTL = 3600        # 402/403/404...: inutile richiederli a ogni ricerca, ma non per sempre
+
+_CACHE: Optional["diskcache.Cache"] = None
+
+
+def _get_cache() -> Optional["diskcache.Cache"]:
+    global _CACHE
+    if _CACHE is None and DISKCACHE_AVAILABLE:
+        _CACHE = diskcache.Cache(DOI_CACHE_DIR)
+    return _CACHE
+
+
+def is_definitive_miss(status: int) -> bool:
+    """Errori client che non cambiano riprovando (tutti i 4xx tranne il 429)."""
+    return 400 <= status < 500 and status != 429
+
+
+def cached_by_doi(namespace: str):
+    """
+    Decoratore per metodi async `(self, session, doi) -> Optional[Dict]`.
+    Il metodo restituisce un dict (vuoto = assenza definitiva) oppure None per
+    un errore transitorio, che non viene memorizzato. Il chiamante riceve sempre un dict.
+    """
+    def decorator(fetch):
+        @functools.wraps(fetch)
+        async def wrapper(self, session, doi: str):
+            cache = _get_cache()
+            key = (namespace, doi.lower()) if doi else None
+            if cache is not None and key is not None:
+                hit = cache.get(key)
+                if hit is not None:
+                    return hit
+
+            result = await fetch(self, session, doi)
+            if result is None:
+                return {}
+            if cache is not None and key is not None:
+                cache.set(key, result, expire=POSITIVE_TTL if result else NEGATIVE_TTL)
+            return result
+        return wrapper
+    return decorator
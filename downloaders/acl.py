@@ -1,6 +1,13 @@
 # downloaders/acl.py
 import asyncio
-from typing import Tuple, List, Dict, Optional
+import itertools
+import operator
+import os
+import pickle
+import re
+import time
+from collections import defaultdict
+from typing import Callable, Tuple, List, Dict, Optional
 
 import aiohttp
 
@@ -11,10 +18,13 @@ except ImportError:
     ANTHOLOGY_AVAILABLE = False
 
 from .base_downloader import BaseDownloader
+from . import utils, http_client
 
 # --- Anthology singleton (evita di bloccare l'event loop) ---
 _ANTHOLOGY_SINGLETON: Optional["Anthology"] = None
 _ANTHOLOGY_INIT_LOCK = asyncio.Lock()
+_ACL_INDEX: Optional["_AclIndex"] = None
+_ACL_INDEX_LOCK = asyncio.Lock()
 
 async def _get_anthology_singleton() -> Optional["Anthology"]:
     global _ANTHOLOGY_SINGLETON
@@ -33,6 +43,28 @@ async def _get_anthology_singleton() -> Optional["Anthology"]:
             _ANTHOLOGY_SINGLETON = None
     return _ANTHOLOGY_SINGLETON
 
+async def _get_acl_index() -> Optional["_AclIndex"]:
+    """
+    Indice di ricerca ACL. Se la cache su disco è fresca non si carica affatto
+    l'Anthology (niente from_repo né parse XML); altrimenti si carica e si ricostruisce.
+    """
+    global _ACL_INDEX
+    if _ACL_INDEX is not None:
+        return _ACL_INDEX
+    async with _ACL_INDEX_LOCK:
+        if _ACL_INDEX is not None:
+            return _ACL_INDEX
+        _ACL_INDEX = await asyncio.to_thread(_AclIndex.load_cached)
+        if _ACL_INDEX is None:
+            anthology = await _get_anthology_singleton()
+            if anthology is not None:
+                try:
+                    _ACL_INDEX = await asyncio.to_thread(_AclIndex.build, anthology)
+                except Exception as e:
+                    print(f"❌ CRITICAL: ACL index build failed: {e}")
+                    _ACL_INDEX = None
+    return _ACL_INDEX
+
 # --- Helper robusti per campi ACL ---
 
 def _text_or_empty(obj) -> str:
@@ -92,29 +124,6 @@ def _authors_as_list(paper) -> List[str]:
     # pulizia
     return [a.strip() for a in out if a and a.strip()]
 
-def _paper_id(paper) -> Optional[str]:
-    for attr in ("full_id", "id", "anthology_id", "bibkey"):
-        if hasattr(paper, attr):
-            try:
-                return str(getattr(paper, attr))
-            except Exception:
-                continue
-    return None
-
-def _paper_year(paper) -> Optional[int]:
-    try:
-        y = getattr(paper, "year", None)
-        return int(str(y)) if y is not None else None
-    except Exception:
-        return None
-
-def _paper_doi(paper) -> Optional[str]:
-    try:
-        d = getattr(paper, "doi", None)
-        return str(d) if d else None
-    except Exception:
-        return None
-
 def _paper_publisher(paper) -> str:
     try:
         p = getattr(paper, "publisher", None)
@@ -125,13 +134,180 @@ def _paper_publisher(paper) -> str:
     # Fallback sicuro (mai None)
     return "ACL Anthology"
 
-def _paper_pdf_url(paper) -> Optional[str]:
-    pid = _paper_id(paper)
-    return f"https://aclanthology.org/{pid}.pdf" if pid else None
+# --- Fast path per la ricerca: gli attributi si risolvono una volta sola ---
+
+_ID_ATTRS = ("full_id", "id", "anthology_id", "bibkey")
+_TEXT_ATTRS = ("text_", "text", "string")
+
+def _first_attrgetter(obj, attrs) -> Optional[Callable]:
+    """attrgetter per il primo attributo di `attrs` presente su `obj` (None se nessuno)."""
+    for attr in attrs:
+        if hasattr(obj, attr):
+            return operator.attrgetter(attr)
+    return None
+
+class _TextReader:
+    """Come _text_or_empty, ma l'attributo da leggere è scelto una volta per tipo."""
+
+    def __init__(self) -> None:
+        self._getters: Dict[type, Optional[Callable]] = {}
+
+    def __call__(self, obj) -> str:
+        if obj is None:
+            return ""
+        cls = type(obj)
+        try:
+            getter = self._getters[cls]
+        except KeyError:
+            getter = self._getters[cls] = _first_attrgetter(obj, _TEXT_ATTRS)
+        try:
+            val = getter(obj) if getter is not None else obj
+            return (val if isinstance(val, str) else str(val)).strip()
+        except Exception:
+            return _text_or_empty(obj)
+
+def _probe_getters(first) -> Dict[str, Optional[Callable]]:
+    """Getter per i campi letti su ogni paper, risolti sul primo paper della sequenza."""
+    def getter(attr):
+        return operator.attrgetter(attr) if hasattr(first, attr) else (lambda _paper: None)
+    return {
+        "title": getter("title"),
+        "abstract": getter("abstract"),
+        "year": getter("year"),
+        "doi": getter("doi"),
+        "id": _first_attrgetter(first, _ID_ATTRS),
+        "has_publisher": hasattr(first, "publisher"),
+    }
+
+def _year_as_int(y) -> int:
+    """Anno come intero; 0 se mancante o non numerico (es. "2020a"), così il paper resta nell'indice."""
+    try:
+        return int(str(y)) if y is not None else 0
+    except (ValueError, TypeError):
+        return 0
+
+def _paper_record(paper, getters: Dict[str, Optional[Callable]], read_text: "_TextReader") -> Dict:
+    """Campi di un paper che servono a ricerca e download, come tipi semplici (picklable)."""
+    y = getters["year"](paper)
+    d = getters["doi"](paper)
+    get_id = getters["id"]
+    venue = getattr(paper, "get_journal_title", lambda: None)() or getattr(paper, "venue", None)
+    return {
+        "id": str(get_id(paper)) if get_id is not None else "",
+        "title": read_text(getters["title"](paper)),
+        "abstract": read_text(getters["abstract"](paper)),
+        "year": _year_as_int(y),
+        "doi": str(d) if d else None,
+        "authors": _authors_as_list(paper),
+        "publisher": _paper_publisher(paper) if getters["has_publisher"] else "ACL Anthology",
+        # alcune versioni espongono venue come lista di id; lasciamo stringa se disponibile
+        "venue": venue if isinstance(venue, str) or venue is None else str(venue),
+    }
+
+# --- Indice persistente: record + inverted index (token -> paper) + mappa DOI ---
+
+_INDEX_PATH = os.path.join(utils.CACHE_DIR, "acl_index.pkl")
+_INDEX_VERSION = 2
+ACL_INDEX_MAX_AGE = 7 * 24 * 3600  # dopo una settimana si ricarica l'Anthology (e si aggiorna il repo)
+_TOKEN_RE = re.compile(r"\w+")
+
+class _AclIndex:
+    """
+    Dati derivati dall'Anthology, salvati in un pickle così le esecuzioni
+    successive non devono rifare from_repo() e il parse di tutto l'XML:
+    - records: un dict per paper, nell'ordine di anthology.papers()
+    - postings: {token: [posizioni]} su titolo + abstract (lowercase)
+    - doi_map: {doi: id ACL} per il download
+    """
 
-def _paper_page_url(paper) -> Optional[str]:
-    pid = _paper_id(paper)
-    return f"https://aclanthology.org/{pid}/" if pid else None
+    def __init__(self, records: List[Dict], postings: Dict[str, List[int]], doi_map: Dict[str, str]) -> None:
+        self.records = records
+        self.postings = postings
+        self.doi_map = doi_map
+
+    @classmethod
+    def load_cached(cls) -> Optional["_AclIndex"]:
+        try:
+            if time.time() - os.path.getmtime(_INDEX_PATH) > ACL_INDEX_MAX_AGE:
+                return None
+            with open(_INDEX_PATH, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") != _INDEX_VERSION:
+                return None
+            # Il repo locale è cambiato dopo la costruzione dell'indice: va rifatto
+            xml_dir = data.get("xml_dir")
+            if xml_dir and os.path.isdir(xml_dir) and os.path.getmtime(xml_dir) > data["built_at"]:
+                return None
+            return cls(data["records"], data["postings"], data["doi_map"])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"⚠️ ACL index cache unreadable, rebuilding: {e}")
+            return None
+
+    @classmethod
+    def build(cls, anthology: "Anthology") -> "_AclIndex":
+        built_at = time.time()
+        records: List[Dict] = []
+        postings: Dict[str, List[int]] = defaultdict(list)
+        doi_map: Dict[str, str] = {}
+
+        iterator = iter(anthology.papers())
+        first = next(iterator, None)
+        if first is not None:
+            getters = _probe_getters(first)
+            read_text = _TextReader()
+            for paper in itertools.chain((first,), iterator):
+                try:
+                    record = _paper_record(paper, getters, read_text)
+                except Exception:
+                    continue
+                pos = len(records)
+                records.append(record)
+                if record["doi"]:
+                    doi_map[record["doi"]] = record["id"]
+                for tok in set(_TOKEN_RE.findall(f"{record['title']} {record['abstract']}".lower())):
+                    postings[tok].append(pos)
+
+        index = cls(records, dict(postings), doi_map)
+        datadir = getattr(anthology, "datadir", None)
+        index._save(os.path.join(str(datadir), "xml") if datadir else None, built_at)
+        return index
+
+    def _save(self, xml_dir: Optional[str], built_at: float) -> None:
+        try:
+            utils.ensure_dir(utils.CACHE_DIR)
+            tmp_path = f"{_INDEX_PATH}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({
+                    "version": _INDEX_VERSION, "built_at": built_at, "xml_dir": xml_dir,
+                    "records": self.records, "postings": self.postings, "doi_map": self.doi_map,
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, _INDEX_PATH)
+        except Exception as e:
+            print(f"⚠️ Could not persist ACL index: {e}")
+
+    def candidates(self, key: str) -> Optional[List[int]]:
+        """
+        Posizioni dei paper che possono contenere `key` (già lowercase), in ordine.
+        La ricerca è per sottostringa ('learn' trova 'learning'), quindi ogni token
+        della chiave si confronta con i token del vocabolario che lo contengono;
+        il controllo esatto resta a _search_sync. None = chiave senza token, serve la scansione.
+        """
+        tokens = set(_TOKEN_RE.findall(key))
+        if not tokens:
+            return None
+        result: Optional[set] = None
+        # prima i token più lunghi: di solito più selettivi
+        for tok in sorted(tokens, key=len, reverse=True):
+            hits = set()
+            for word, positions in self.postings.items():
+                if tok in word:
+                    hits.update(positions)
+            result = hits if result is None else result & hits
+            if not result:
+                return []
+        return sorted(result)
 
 
 class AclDownloader(BaseDownloader):
@@ -141,7 +317,7 @@ class AclDownloader(BaseDownloader):
 
     async def download(
         self,
-        session: aiohttp.ClientSession,
+        session: Optional[aiohttp.ClientSession],
         doi: str,
         publisher_dir: str,
     ) -> Tuple[bool, List[str], str]:
@@ -160,23 +336,15 @@ class AclDownloader(BaseDownloader):
             elif "/v1/" in doi:  # la maggior parte dei DOI ACL embedda l'ID
                 acl_id = doi.split("/v1/", 1)[1]
             elif low.startswith("10."):
-                anthology = await _get_anthology_singleton()
-                if anthology is not None:
-                    # ricerca lenta ma affidabile
-                    def _find_by_doi() -> Optional[str]:
-                        for p in anthology.papers():
-                            try:
-                                if getattr(p, "doi", None) == doi:
-                                    return _paper_id(p)
-                            except Exception:
-                                continue
-                        return None
-                    acl_id = await asyncio.to_thread(_find_by_doi)
+                index = await _get_acl_index()
+                if index is not None:
+                    acl_id = index.doi_map.get(doi)
 
         if not acl_id:
             return (False, [], f"ACL download: unable to resolve paper id from doi='{doi}'")
 
         pdf_url = f"https://aclanthology.org/{acl_id}.pdf"
+        session = http_client.get_session(session)
 
         # Scarica il PDF (semplice; adatta se hai già una routine comune)
         try:
@@ -188,13 +356,9 @@ class AclDownloader(BaseDownloader):
             # Salvataggio
             safe_id = acl_id.replace("/", "_")
             out_path = f"{publisher_dir}/{safe_id}.pdf"
-            # NB: scrittura sincrona delegata a thread per non bloccare
-            def _write():
-                import os
-                os.makedirs(publisher_dir, exist_ok=True)
-                with open(out_path, "wb") as f:
-                    f.write(content)
-            await asyncio.to_thread(_write)
+            # NB: scrittura delegata a thread per non bloccare
+            utils.ensure_dir(publisher_dir)
+            await utils.write_bytes(out_path, content)
 
             return (True, [out_path], "ok")
         except Exception as e:
@@ -202,7 +366,7 @@ class AclDownloader(BaseDownloader):
 
     async def search(
         self,
-        session: aiohttp.ClientSession,
+        session: Optional[aiohttp.ClientSession],
         keyword: str,
         year: Optional[int] = None,
         max_results: int = 200,
@@ -211,8 +375,8 @@ class AclDownloader(BaseDownloader):
             print("  - [ACL Search] acl-anthology-py not available. Skipping.")
             return []
 
-        anthology = await _get_anthology_singleton()
-        if anthology is None:
+        index = await _get_acl_index()
+        if index is None:
             print("  - [ACL Search] Anthology instance unavailable. Skipping.")
             return []
 
@@ -224,55 +388,46 @@ class AclDownloader(BaseDownloader):
         cap = max(1, int(max_results))
 
         # Iterazione pesante in thread per non bloccare l'event loop
-        return await asyncio.to_thread(self._search_sync, anthology, key, min_year, cap)
+        return await asyncio.to_thread(self._search_sync, index, key, min_year, cap)
 
     # --- worker sincrono ---
-    def _search_sync(self, anthology: "Anthology", key: str, min_year: int, cap: int) -> List[Dict]:
+    def _search_sync(self, index: _AclIndex, key: str, min_year: int, cap: int) -> List[Dict]:
         out: List[Dict] = []
-        try:
-            iterator = anthology.papers()  # <- CORRETTO: è un generatore, non un dict
-        except Exception as e:
-            print(f"  - [ACL Search] ERROR getting papers iterator: {e}")
-            return out
+        positions = index.candidates(key)
+        if positions is None:
+            positions = range(len(index.records))
 
-        for paper in iterator:
+        for pos in positions:
             if len(out) >= cap:
                 break
-            try:
-                py = _paper_year(paper) or 0
-                if py < min_year:
-                    continue
-
-                title = _text_or_empty(getattr(paper, "title", None))
-                abstract = _text_or_empty(getattr(paper, "abstract", None))
-                if key not in title.lower() and key not in abstract.lower():
-                    continue
+            paper = index.records[pos]
+            py = paper["year"]
+            if py < min_year:
+                continue
 
-                pid = _paper_id(paper) or ""
-                real_doi = _paper_doi(paper)  # può essere None
-                publisher_name = _paper_publisher(paper)
-
-                record: Dict = {
-                    "id": pid,
-                    "title": title or "Untitled",
-                    "authors": _authors_as_list(paper),          # ['Alice Rossi', 'Bob Bianchi', ...]
-                    "year": py if py else None,
-                    "abstract": abstract or None,
-                    # Mantieni compatibilità download: se il DOI vero non c'è, usa 'acl:<id>'
-                    "doi": real_doi if real_doi else f"acl:{pid}",
-                    # Extra: se vuoi mostrare il DOI “vero” in GUI, usa questo campo
-                    "external_doi": real_doi,
-                    "url": _paper_page_url(paper),
-                    "pdf_url": _paper_pdf_url(paper),
-                    # IMPORTANTISSIMO: mai None, così sanitize_filename non esplode
-                    "publisher": publisher_name,                 # es. "Association for Computational Linguistics" o fallback "ACL Anthology"
-                    "source": "ACL",
-                    # alcune versioni espongono venue come lista di id; lasciamo stringa se disponibile
-                    "venue": getattr(paper, "get_journal_title", lambda: None)() or getattr(paper, "venue", None),
-                }
-                out.append(record)
-            except Exception:
+            title, abstract = paper["title"], paper["abstract"]
+            if key not in title.lower() and key not in abstract.lower():
                 continue
 
+            pid = paper["id"]
+            real_doi = paper["doi"]  # può essere None
+            out.append({
+                "id": pid,
+                "title": title or "Untitled",
+                "authors": list(paper["authors"]),         # ['Alice Rossi', 'Bob Bianchi', ...]
+                "year": py if py else None,
+                "abstract": abstract or None,
+                # Mantieni compatibilità download: se il DOI vero non c'è, usa 'acl:<id>'
+                "doi": real_doi if real_doi else f"acl:{pid}",
+                # Extra: se vuoi mostrare il DOI “vero” in GUI, usa questo campo
+                "external_doi": real_doi,
+                "url": f"https://aclanthology.org/{pid}/" if pid else None,
+                "pdf_url": f"https://aclanthology.org/{pid}.pdf" if pid else None,
+                # IMPORTANTISSIMO: mai None, così sanitize_filename non esplode
+                "publisher": paper["publisher"],           # es. "Association for Computational Linguistics" o fallback "ACL Anthology"
+                "source": "ACL",
+                "venue": paper["venue"],
+            })
+
         print(f"  - [ACL Search] Found {len(out)} results from local data.")
         return out
@@ -1,63 +1,114 @@
 # downloaders/arxiv.py
-import os, json, random, asyncio, re, xml.etree.ElementTree as ET
+from collections import OrderedDict
+from io import BytesIO
 from typing import Tuple, List, Dict, Optional
 import aiohttp
+from lxml import etree
 from urllib.parse import quote_plus
 from .base_downloader import BaseDownloader
-from . import utils
+from . import utils, http_client
+
+# arXiv chiede al massimo una richiesta ogni 3 secondi: si aspetta solo se serve davvero
+_ARXIV_API_LIMITER = utils.RateLimiter(1, 3.0)   # export.arxiv.org (search + metadata)
+_ARXIV_PDF_LIMITER = utils.RateLimiter(1, 3.0)   # arxiv.org/pdf
+
+_ATOM = "{http://www.w3.org/2005/Atom}"
+
+# The GUI keeps the same downloader for the whole session: keep only the most recent search entries
+KNOWN_ENTRIES_MAX = 2000
 
 class ArxivDownloader(BaseDownloader):
-    def _parse_single_entry(self, entry: ET.Element) -> Dict:
-        """Extracts metadata from a single ArXiv <entry> XML tag."""
+    def __init__(self) -> None:
+        # Entries already seen during search, keyed by internal doi ('arxiv:<id>'):
+        # lets download() skip the metadata API call when the pdf_url is known.
+        # Entries are dropped once download() has used them.
+        self._known_entries: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def _parse_single_entry(self, entry: etree._Element) -> Dict:
+        """Extracts metadata from a single ArXiv <entry> XML tag (Atom namespace)."""
         try:
-            arxiv_id_url = entry.find('id').text
+            arxiv_id_url = entry.find(f'{_ATOM}id').text
             arxiv_id = arxiv_id_url.split('/abs/')[-1]
             doi = f"arxiv:{arxiv_id}"
 
-            title = entry.find('title').text.strip().replace('\n', ' ')
-            abstract = entry.find('summary').text.strip().replace('\n', ' ')
-            published_date = entry.find('published').text
+            title = entry.find(f'{_ATOM}title').text.strip().replace('\n', ' ')
+            abstract = entry.find(f'{_ATOM}summary').text.strip().replace('\n', ' ')
+            published_date = entry.find(f'{_ATOM}published').text
             year = published_date.split('-')[0]
             
-            authors = [author.find('name').text for author in entry.findall('author')]
-            keywords = [cat.get('term') for cat in entry.findall('category')]
+            authors = [author.find(f'{_ATOM}name').text for author in entry.findall(f'{_ATOM}author')]
+            keywords = [cat.get('term') for cat in entry.findall(f'{_ATOM}category')]
+            pdf_url = next((link.get('href') for link in entry.findall(f'{_ATOM}link[@title="pdf"]')), None)
 
             return {
                 'doi': doi, 'title': title, 'authors': authors, 'editor': 'ArXiv',
-                'year': year, 'abstract': abstract, 'keywords': keywords
+                'year': year, 'abstract': abstract, 'keywords': keywords,
+                'pdf_url': pdf_url, 'abs_url': arxiv_id_url
             }
         except Exception as e:
             print(f"  - ArXiv entry parsing error: {e}")
             return {}
 
-    async def download(self, session: aiohttp.ClientSession, doi: str, publisher_dir: str) -> Tuple[bool, List[str], str]:
+    async def download(self, session: Optional[aiohttp.ClientSession], doi: str, publisher_dir: str) -> Tuple[bool, List[str], str]:
+        session = http_client.get_session(session)
         if not doi.lower().startswith('arxiv:'):
             return False, [], "not_arxiv"
         
         arxiv_id = doi.split(':', 1)[1]
         formats_downloaded = []
-        
-        # 1. API call for metadata
+
+        # 1. Metadata: the entry parsed during search already carries the pdf_url,
+        #    so the API call is only needed for papers we have not seen yet
+        known_entry = self._known_entries.pop(doi, None)
+        if known_entry and known_entry.get('pdf_url'):
+            xml_content, pdf_url = known_entry['xml'], known_entry['pdf_url']
+        else:
+            xml_content, pdf_url = await self._fetch_api_metadata(session, doi, arxiv_id)
+
+        if xml_content:
+            try:
+                xml_path = utils.output_path(publisher_dir, 'xml', doi)
+                await utils.write_text(xml_path, xml_content)
+                formats_downloaded.append('xml')
+            except Exception as e:
+                print(f"  - [ArXiv] XML write error: {e}")
+
+        # 2. PDF Download
+        pdf_url = pdf_url or f"https://arxiv.org/pdf/{arxiv_id}.pdf"
+        try:
+            await _ARXIV_PDF_LIMITER.acquire()
+            print(f"  - [ArXiv] Downloading PDF for {doi}")
+            async with session.get(pdf_url, timeout=30) as response:
+                if response.status == 200:
+                    pdf_path = utils.output_path(publisher_dir, 'pdf', doi)
+                    is_valid, _, _ = await utils.stream_pdf(response, pdf_path, doi)
+                    if is_valid:
+                        formats_downloaded.append('pdf')
+                else:
+                    print(f"  - [ArXiv] PDF download error: HTTP {response.status}")
+        except Exception as e:
+            print(f"  - [ArXiv] PDF download error: {e}")
+
+        return len(formats_downloaded) > 0, sorted(list(set(formats_downloaded))), "success" if formats_downloaded else "download_failed"
+
+    async def _fetch_api_metadata(self, session: aiohttp.ClientSession, doi: str, arxiv_id: str) -> Tuple[Optional[str], Optional[str]]:
+        """Fallback for papers not seen during search. Returns (xml_content, pdf_url)."""
         api_url = f"http://export.arxiv.org/api/query?id_list={arxiv_id}"
-        full_metadata = {}
+        xml_content, pdf_url = None, None
         try:
-            await asyncio.sleep(random.uniform(3, 5))
+            await _ARXIV_API_LIMITER.acquire()
             print(f"  - [ArXiv] API call for {doi}")
             async with session.get(api_url, timeout=20) as response:
                 if response.status == 200:
                     xml_content = await response.text()
-                    
-                    xml_path = os.path.join(publisher_dir, 'xml', f"{utils.sanitize_filename(doi)}.xml")
-                    with open(xml_path, 'w', encoding='utf-8') as f: f.write(xml_content)
-                    formats_downloaded.append('xml')
-                    
+
                     # This parsing is simple, just to get the pdf_url if it exists
                     try:
-                        root = ET.fromstring(xml_content)
-                        entry = root.find("{http://www.w3.org/2005/Atom}entry")
+                        root = etree.fromstring(xml_content.encode('utf-8'))
+                        entry = root.find(f"{_ATOM}entry")
                         if entry is not None:
-                            for link in entry.findall('{http://www.w3.org/2005/Atom}link[@title="pdf"]'):
-                                full_metadata['pdf_url'] = link.get('href')
+                            for link in entry.findall(f'{_ATOM}link[@title="pdf"]'):
+                                pdf_url = link.get('href')
                     except Exception:
                         pass # Ignore if parsing for pdf_url fails
 
@@ -67,28 +118,10 @@ class ArxivDownloader(BaseDownloader):
         except Exception as e:
             print(f"  - [ArXiv] API error: {e}")
 
-        # 2. PDF Download
-        pdf_url = full_metadata.get('pdf_url', f"https://arxiv.org/pdf/{arxiv_id}.pdf")
-        try:
-            await asyncio.sleep(random.uniform(3, 5))
-            print(f"  - [ArXiv] Downloading PDF for {doi}")
-            async with session.get(pdf_url, timeout=30) as response:
-                if response.status == 200:
-                    content = await response.read()
-                    is_valid, _, _ = utils.validate_pdf_multi_library(content, doi)
-                    if is_valid:
-                        pdf_path = os.path.join(publisher_dir, 'pdf', f"{utils.sanitize_filename(doi)}.pdf")
-                        with open(pdf_path, 'wb') as f: f.write(content)
-                        formats_downloaded.append('pdf')
-                else:
-                    print(f"  - [ArXiv] PDF download error: HTTP {response.status}")
-        except Exception as e:
-            print(f"  - [ArXiv] PDF download error: {e}")
+        return xml_content, pdf_url
 
-        return len(formats_downloaded) > 0, sorted(list(set(formats_downloaded))), "success" if formats_downloaded else "download_failed"
-
-
-    async def search(self, session: aiohttp.ClientSession, keyword: str, year: Optional[int] = None, max_results: int = 200) -> List[Dict]:
+    async def search(self, session: Optional[aiohttp.ClientSession], keyword: str, year: Optional[int] = None, max_results: int = 200) -> List[Dict]:
+        session = http_client.get_session(session)
         query = f'all:"{keyword}"'
         if year and 1900 < year < 2100:
             query += f' AND submittedDate:[{year}0101 TO {year}1231]'
@@ -98,18 +131,28 @@ class ArxivDownloader(BaseDownloader):
         
         try:
             print(f"  - [ArXiv Search] Searching for '{keyword}' (Year: {year or 'All'})")
-            await asyncio.sleep(random.uniform(3, 5))
+            await _ARXIV_API_LIMITER.acquire()
             async with session.get(search_url, params=params, timeout=30) as response:
                 if response.status != 200:
                     print(f"  - [ArXiv Search] API Error: HTTP {response.status}")
                     return []
 
-                xml_content = await response.text()
-                # Remove namespace for easier parsing
-                xml_content = re.sub(r' xmlns="[^"]+"', '', xml_content, count=1)
-                root = ET.fromstring(xml_content)
-                
-                articles = [meta for entry in root.findall("entry") if (meta := self._parse_single_entry(entry))]
+                xml_bytes = await response.read()
+
+                # Stream the <entry> elements: no namespace-stripping copy, no full tree kept around
+                articles = []
+                for _, entry in etree.iterparse(BytesIO(xml_bytes), tag=f"{_ATOM}entry"):
+                    meta = self._parse_single_entry(entry)
+                    if meta:
+                        self._known_entries[meta['doi']] = {
+                            'pdf_url': meta['pdf_url'],
+                            'xml': etree.tostring(entry, encoding='unicode')
+                        }
+                        self._known_entries.move_to_end(meta['doi'])
+                        if len(self._known_entries) > KNOWN_ENTRIES_MAX:
+                            self._known_entries.popitem(last=False)
+                        articles.append(meta)
+                    entry.clear()
                 
                 print(f"  - [ArXiv Search] Found {len(articles)} results.")
                 return articles
@@ -9,19 +9,20 @@ class BaseDownloader(ABC):
     @abstractmethod
     async def download(
         self, 
-        session: aiohttp.ClientSession, 
+        session: Optional[aiohttp.ClientSession], 
         doi: str, 
         publisher_dir: str
     ) -> Tuple[bool, List[str], str]:
         """
         Downloads the full text of an article given a DOI.
+        With session=None the shared session of http_client is used.
         """
         pass
 
     @abstractmethod
     async def search(
         self,
-        session: aiohttp.ClientSession,
+        session: Optional[aiohttp.ClientSession],
         keyword: str,
         year: Optional[int] = None,
         max_results: int = 200
@@ -1,83 +1,106 @@
 # downloaders/elsevier.py
 import os
-import json
-import random
 import asyncio
 from typing import Tuple, List, Dict, Optional
 import aiohttp
-from urllib.parse import quote_plus
 from .base_downloader import BaseDownloader
-from . import utils
+from . import utils, http_client
+from ._doi_cache import cached_by_doi, is_definitive_miss
 
 # API KEY
 
 ELSEVIER_API_KEY = os.getenv("ELSEVIER_API_KEY")
 #ELSEVIER_API_KEY = os.getenv("ELSEVIER_API_KEY", "MANUAL_API_KEY")
 ELSEVIER_INST_TOKEN = os.getenv("ELSEVIER_INST_TOKEN", "")
-USER_AGENTS = ["Mozilla/5.0 (Research; TDM) Chrome/120.0 Academic/TDM"]
+SCOPUS_SEARCH_URL = "https://api.elsevier.com/content/search/scopus"
+
+# api.elsevier.com: quota Scopus di ~9 richieste/s per chiave
+_ELSEVIER_LIMITER = utils.RateLimiter(9, 1.0)
 
 class ElsevierDownloader(BaseDownloader):
-    async def download(self, session: aiohttp.ClientSession, doi: str, publisher_dir: str) -> Tuple[bool, List[str], str]:
+    # Scopus view=COMPLETE (abstract + authors in the search results) needs an entitled API key
+    _complete_view = True
+
+    async def download(self, session: Optional[aiohttp.ClientSession], doi: str, publisher_dir: str) -> Tuple[bool, List[str], str]:
+        session = http_client.get_session(session)
         if not ELSEVIER_API_KEY:
             return False, [], "api_key_missing"
         
-        formats_downloaded = []
-        headers = {"X-ELS-APIKey": ELSEVIER_API_KEY, "User-Agent": random.choice(USER_AGENTS)}
+        headers = {"X-ELS-APIKey": ELSEVIER_API_KEY, "User-Agent": utils.UA}
         if ELSEVIER_INST_TOKEN:
             headers["X-ELS-Insttoken"] = ELSEVIER_INST_TOKEN
-        
-        # PDF
+        article_url = f"https://api.elsevier.com/content/article/doi/{utils.quote_doi(doi)}"
+
+        # PDF, XML e JSON sono indipendenti: tre richieste in parallelo sulla stessa sessione
+        results = await asyncio.gather(
+            self._fetch_pdf(session, article_url, headers, doi, publisher_dir),
+            self._fetch_text(session, article_url, headers, doi, publisher_dir, 'xml', 'application/xml'),
+            self._fetch_text(session, article_url, headers, doi, publisher_dir, 'json', 'application/json'),
+            return_exceptions=True,
+        )
+        formats_downloaded = [fmt for fmt in results if fmt in ('pdf', 'xml', 'json')]
+        if formats_downloaded:
+            return True, formats_downloaded, "success"
+        return False, [], utils.PAYWALLED if utils.PAYWALLED in results else "failed"
+
+    async def _fetch_pdf(self, session: aiohttp.ClientSession, article_url: str, headers: Dict, doi: str, publisher_dir: str) -> Optional[str]:
         try:
-            async with session.get(f"https://api.elsevier.com/content/article/doi/{quote_plus(doi)}", 
+            await _ELSEVIER_LIMITER.acquire()
+            async with session.get(article_url, 
                                  headers={**headers, "Accept": "application/pdf"}, 
                                  timeout=aiohttp.ClientTimeout(total=25)) as response:
+                if response.status in utils.PAYWALL_STATUSES:
+                    return utils.PAYWALLED
                 if response.status == 200:
-                    content = await response.read()
-                    is_valid, pages, _ = utils.validate_pdf_multi_library(content, doi)
+                    filename = utils.output_path(publisher_dir, 'pdf', doi)
+                    is_valid, pages, _ = await utils.stream_pdf(response, filename, doi)
                     if is_valid:
-                        filename = os.path.join(publisher_dir, 'pdf', f"{utils.sanitize_filename(doi)}.pdf")
-                        with open(filename, 'wb') as f: f.write(content)
-                        formats_downloaded.append('pdf')
+                        return 'pdf'
         except Exception as e:
             print(f"  - Elsevier PDF error: {e}")
+        return None
 
-        # XML and JSON
-        for fmt, accept_header in [('xml', 'application/xml'), ('json', 'application/json')]:
-            try:
-                await asyncio.sleep(0.5)
-                async with session.get(f"https://api.elsevier.com/content/article/doi/{quote_plus(doi)}", 
-                                     headers={**headers, "Accept": accept_header},
-                                     timeout=aiohttp.ClientTimeout(total=20)) as response:
-                    if response.status == 200:
-                        content = await response.text()
-                        if content:
-                            filename = os.path.join(publisher_dir, fmt, f"{utils.sanitize_filename(doi)}.{fmt}")
-                            with open(filename, 'w', encoding='utf-8') as f: f.write(content)
-                            formats_downloaded.append(fmt)
-            except Exception: pass
-        
-        return len(formats_downloaded) > 0, formats_downloaded, "success" if formats_downloaded else "failed"
+    async def _fetch_text(self, session: aiohttp.ClientSession, article_url: str, headers: Dict, doi: str, publisher_dir: str,
+                          fmt: str, accept_header: str) -> Optional[str]:
+        try:
+            await _ELSEVIER_LIMITER.acquire()
+            async with session.get(article_url, 
+                                 headers={**headers, "Accept": accept_header},
+                                 timeout=aiohttp.ClientTimeout(total=20)) as response:
+                if response.status in utils.PAYWALL_STATUSES:
+                    return utils.PAYWALLED
+                if response.status == 200:
+                    content = await response.text()
+                    if content:
+                        filename = utils.output_path(publisher_dir, fmt, doi)
+                        await utils.write_text(filename, content)
+                        return fmt
+        except Exception: pass
+        return None
 
-    async def _fetch_full_metadata(self, session: aiohttp.ClientSession, doi: str) -> Dict:
-        """Helper function to get full metadata for a single DOI."""
+    @cached_by_doi("elsevier")
+    async def _fetch_full_metadata(self, session: aiohttp.ClientSession, doi: str) -> Optional[Dict]:
+        """Helper function to get full metadata for a single DOI (None on transient errors)."""
         if not doi: return {}
-        meta_url = f"https://api.elsevier.com/content/article/doi/{quote_plus(doi)}"
+        meta_url = f"https://api.elsevier.com/content/article/doi/{utils.quote_doi(doi)}"
         headers = {"X-ELS-APIKey": ELSEVIER_API_KEY, "Accept": "application/json"}
         
         try:
+            await _ELSEVIER_LIMITER.acquire()
             async with session.get(meta_url, headers=headers, timeout=15) as response:
                 if response.status == 200:
-                    data = await response.json()
+                    data = utils.json_loads(await response.read())
                     coredata = data.get('full-text-retrieval-response', {}).get('coredata', {})
                     authors = [author.get('$') for author in coredata.get('dc:creator', []) if author]
                     abstract = coredata.get('dc:description', '')
                     return {'authors': authors, 'abstract': abstract}
-                return {}
+                return {} if is_definitive_miss(response.status) else None
         except Exception:
-            return {}
+            return None
 
-    async def search(self, session: aiohttp.ClientSession, keyword: str, year: Optional[int] = None, max_results: int = 200) -> List[Dict]:
+    async def search(self, session: Optional[aiohttp.ClientSession], keyword: str, year: Optional[int] = None, max_results: int = 200) -> List[Dict]:
         """Searches for articles and then enriches the results with full metadata."""
+        session = http_client.get_session(session)
         if not ELSEVIER_API_KEY:
             print("  - [Elsevier Search] API key (ELSEVIER_API_KEY) is missing.")
             return []
@@ -90,51 +113,65 @@ class ElsevierDownloader(BaseDownloader):
         if year and 1900 < year < 2100:
             query += f' AND PUBYEAR IS {year}'
 
-        search_url = "https://api.elsevier.com/content/search/scopus"
         headers = {"X-ELS-APIKey": ELSEVIER_API_KEY, "Accept": "application/json"}
         params = {"query": query, "count": safe_max_results}
 
         try:
             print(f"  - [Elsevier Search] Step 1: Searching for '{keyword}' (Year: {year or 'All'})")
-            async with session.get(search_url, headers=headers, params=params, timeout=30) as response:
-                if response.status != 200:
-                    print(f"  - [Elsevier Search] API Error: HTTP {response.status} - {await response.text()}")
-                    return []
-
-                data = await response.json()
-                
-                articles_to_enrich = []
-                for entry in data.get('search-results', {}).get('entry', []):
-                    cover_date = entry.get('prism:coverDate', 'N/A')
-                    extracted_year = cover_date.split('-')[0] if cover_date else 'N/A'
-                    
-                    articles_to_enrich.append({
-                        'doi': entry.get('prism:doi', ''),
-                        'title': entry.get('dc:title', 'No Title'),
-                        'editor': 'Elsevier',
-                        'year': extracted_year,
-                    })
-
-                if not articles_to_enrich:
-                    return []
+            response = await self._scopus_search(session, headers, params)
+            if response.status != 200:
+                print(f"  - [Elsevier Search] API Error: HTTP {response.status} - {await response.text()}")
+                return []
+
+            data = utils.json_loads(await response.read())
+            
+            # With view=COMPLETE Scopus already returns authors and abstract: the per-DOI
+            # request is only needed for entries still missing one of them
+            articles, articles_to_enrich, tasks = [], [], []
+            for entry in data.get('search-results', {}).get('entry', []):
+                cover_date = entry.get('prism:coverDate', 'N/A')
+                extracted_year = cover_date.split('-')[0] if cover_date else 'N/A'
+                doi = entry.get('prism:doi', '')
+
+                article = {
+                    'doi': doi,
+                    'title': entry.get('dc:title', 'No Title'),
+                    'editor': 'Elsevier',
+                    'year': extracted_year,
+                    'authors': [author['authname'] for author in entry.get('author', []) if author.get('authname')],
+                    'abstract': entry.get('dc:description', ''),
+                    'keywords': [kw.strip() for kw in entry.get('authkeywords', '').split('|') if kw.strip()],
+                }
+                articles.append(article)
+                if not (article['authors'] and article['abstract']):
+                    articles_to_enrich.append(article)
+                    tasks.append(self._fetch_full_metadata(session, doi))
 
+            if not articles:
+                return []
+
+            if articles_to_enrich:
                 print(f"  - [Elsevier Search] Step 2: Enriching {len(articles_to_enrich)} articles.")
-                tasks = [self._fetch_full_metadata(session, article['doi']) for article in articles_to_enrich]
-                metadata_results = await asyncio.gather(*tasks)
-
-                enriched_articles = []
-                for i, article in enumerate(articles_to_enrich):
-                    full_meta = metadata_results[i]
-                    article.update({
-                        'authors': full_meta.get('authors', ['N/A']),
-                        'abstract': full_meta.get('abstract', 'No abstract available.'),
-                        'keywords': []
-                    })
-                    enriched_articles.append(article)
-                
-                print(f"  - [Elsevier Search] Found and enriched {len(enriched_articles)} results.")
-                return enriched_articles
+                metadata_results = await utils.bounded_gather(tasks)
+                for article, full_meta in zip(articles_to_enrich, metadata_results):
+                    article['authors'] = article['authors'] or full_meta.get('authors', ['N/A'])
+                    article['abstract'] = article['abstract'] or full_meta.get('abstract', 'No abstract available.')
+            
+            print(f"  - [Elsevier Search] Found and enriched {len(articles)} results.")
+            return articles
 
         except Exception as e:
             print(f"  - [Elsevier Search] Critical error during search: {e}")
-            return []
\ No newline at end of file
+            return []
+
+    async def _scopus_search(self, session: aiohttp.ClientSession, headers: Dict, params: Dict) -> http_client.CachedResponse:
+        """Scopus search, asking for the COMPLETE view first; keys without that entitlement get 401/403 and fall back to STANDARD."""
+        if self._complete_view:
+            async with http_client.cached_get(session, SCOPUS_SEARCH_URL, headers=headers, params={**params, "view": "COMPLETE"},
+                                              timeout=30, limiter=_ELSEVIER_LIMITER) as response:
+                if response.status not in (401, 403):
+                    return response
+            self._complete_view = False  # non riproviamo a ogni ricerca
+        async with http_client.cached_get(session, SCOPUS_SEARCH_URL, headers=headers, params=params,
+                                          timeout=30, limiter=_ELSEVIER_LIMITER) as response:
+            return response
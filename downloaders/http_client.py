@@ -0,0 +1,212 @@
+# downloaders/http_client.py
+
+import asyncio
+import hashlib
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import aiohttp
+
+from .utils import CACHE_DIR, DEFAULT_HEADERS, RateLimiter
+
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+
+try:
+    import httpx
+    import h2  # noqa: F401  (richiesto da httpx per http2=True)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Il carico è quasi tutto rete (una manciata di API per DOI): keep-alive e
+# riuso delle connessioni TLS contano più di qualsiasi ottimizzazione locale.
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 10
+DNS_CACHE_TTL = 300  # secondi
+
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=60)
+
+# Una sessione per event loop: la GUI fa un asyncio.run() per ogni ricerca/download
+# e una ClientSession non può sopravvivere al loop in cui è nata.
+_SESSIONS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+
+def create_connector(limit: int = CONNECTION_LIMIT, limit_per_host: int = CONNECTION_LIMIT_PER_HOST) -> aiohttp.TCPConnector:
+    return aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        enable_cleanup_closed=True,
+        ssl=False,
+    )
+
+
+def create_session(limit: int = CONNECTION_LIMIT, limit_per_host: int = CONNECTION_LIMIT_PER_HOST) -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        connector=create_connector(limit, limit_per_host),
+        timeout=DEFAULT_TIMEOUT,
+        headers=DEFAULT_HEADERS,
+    )
+
+
+def get_session(session: Optional[aiohttp.ClientSession] = None) -> aiohttp.ClientSession:
+    """
+    Restituisce `session` se passata, altrimenti la sessione condivisa
+    dell'event loop corrente (creata alla prima richiesta).
+    """
+    if session is not None:
+        return session
+    loop = asyncio.get_running_loop()
+    shared = _SESSIONS.get(loop)
+    if shared is None or shared.closed:
+        shared = _SESSIONS[loop] = create_session()
+    return shared
+
+
+# Client HTTP/2 (httpx), anch'esso uno per loop: le ricerche CrossRef di Wiley e MDPI
+# viaggiano come stream paralleli sulla stessa connessione verso api.crossref.org
+_HTTP2_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def get_http2_client() -> Optional["httpx.AsyncClient"]:
+    """Client httpx HTTP/2 condiviso del loop corrente, o None se httpx/h2 non sono installati."""
+    if not HTTP2_AVAILABLE:
+        return None
+    loop = asyncio.get_running_loop()
+    client = _HTTP2_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        client = _HTTP2_CLIENTS[loop] = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=CONNECTION_LIMIT),
+            timeout=DEFAULT_TIMEOUT.total,
+            headers=DEFAULT_HEADERS,
+            verify=False,  # come il connettore aiohttp
+        )
+    return client
+
+
+async def close_session() -> None:
+    """Chiude la sessione condivisa del loop corrente (da chiamare prima che il loop termini)."""
+    loop = asyncio.get_running_loop()
+    shared = _SESSIONS.pop(loop, None)
+    if shared is not None and not shared.closed:
+        await shared.close()
+    client = _HTTP2_CLIENTS.pop(loop, None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+@asynccontextmanager
+async def shared_session():
+    """`async with shared_session() as session:` — sessione condivisa, chiusa all'uscita."""
+    try:
+        yield get_session()
+    finally:
+        await close_session()
+
+
+# --- Cache delle risposte delle API di ricerca ---
+# Stessa (keyword, anno) => stesso JSON: entro SEARCH_CACHE_TTL si risponde dal disco,
+# dopo si rivalida con ETag / Last-Modified (un 304 costa molto meno del body).
+HTTP_CACHE_DIR = os.path.join(CACHE_DIR, "http")
+SEARCH_CACHE_TTL = 3600            # secondi in cui la risposta è considerata fresca
+HTTP_CACHE_KEEP = 7 * 86400        # quanto tenerla su disco per la rivalidazione
+
+_HTTP_CACHE: Optional["diskcache.Cache"] = None
+
+
+def _get_http_cache() -> Optional["diskcache.Cache"]:
+    global _HTTP_CACHE
+    if _HTTP_CACHE is None and DISKCACHE_AVAILABLE:
+        _HTTP_CACHE = diskcache.Cache(HTTP_CACHE_DIR)
+    return _HTTP_CACHE
+
+
+def _cache_key(url: str, params: Optional[Dict], headers: Optional[Dict]) -> str:
+    # Hash di tutto: URL e header contengono le chiavi API, che non finiscono in chiaro su disco
+    raw = repr((url, sorted((params or {}).items()), sorted((headers or {}).items())))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CachedResponse:
+    """Risposta già letta (da rete o da cache) con l'interfaccia minima usata dai downloader."""
+
+    def __init__(self, status: int, body: bytes, from_cache: bool = False) -> None:
+        self.status = status
+        self.body = body
+        self.from_cache = from_cache
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def text(self, encoding: str = "utf-8") -> str:
+        return self.body.decode(encoding, errors="replace")
+
+
+async def _get(session: aiohttp.ClientSession, url: str, params: Optional[Dict], headers: Dict,
+               timeout: int, http2: bool):
+    """GET via httpx (HTTP/2) se richiesto e disponibile, altrimenti aiohttp. -> (status, headers, body)"""
+    client = get_http2_client() if http2 else None
+    if client is not None:
+        response = await client.get(url, params=params, headers=headers, timeout=timeout)
+        return response.status_code, response.headers, response.content
+    async with session.get(url, params=params, headers=headers, timeout=timeout) as response:
+        return response.status, response.headers, await response.read()
+
+
+async def _fetch_cached(session: aiohttp.ClientSession, url: str, params: Optional[Dict],
+                        headers: Optional[Dict], timeout: int, expire: int,
+                        limiter: Optional[RateLimiter], http2: bool) -> CachedResponse:
+    cache = _get_http_cache()
+    key = _cache_key(url, params, headers)
+    entry = cache.get(key) if cache is not None else None
+    now = time.time()
+    if entry and now - entry["stored_at"] < expire:
+        return CachedResponse(200, entry["body"], from_cache=True)
+
+    request_headers = dict(headers or {})
+    if entry:
+        if entry.get("etag"):
+            request_headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            request_headers["If-Modified-Since"] = entry["last_modified"]
+
+    if limiter is not None:  # il rate limit vale solo per le richieste che escono davvero
+        await limiter.acquire()
+    status, response_headers, body = await _get(session, url, params, request_headers, timeout, http2)
+    if status == 304 and entry:
+        entry["stored_at"] = now
+        cache.set(key, entry, expire=HTTP_CACHE_KEEP)
+        return CachedResponse(200, entry["body"], from_cache=True)
+
+    if (status == 200 and cache is not None
+            and "no-store" not in response_headers.get("Cache-Control", "")):
+        cache.set(key, {
+            "body": body,
+            "etag": response_headers.get("ETag"),
+            "last_modified": response_headers.get("Last-Modified"),
+            "stored_at": now,
+        }, expire=HTTP_CACHE_KEEP)
+    return CachedResponse(status, body)
+
+
+@asynccontextmanager
+async def cached_get(session: aiohttp.ClientSession, url: str, *, params: Optional[Dict] = None,
+                     headers: Optional[Dict] = None, timeout: int = 30, expire: int = SEARCH_CACHE_TTL,
+                     limiter: Optional[RateLimiter] = None, http2: bool = False):
+    """
+    GET con cache su disco, per le API di ricerca (non per i PDF).
+    `limiter` si applica solo alle richieste che escono davvero; `http2=True` usa il
+    client httpx condiviso (se disponibile) al posto della sessione aiohttp.
+
+        async with http_client.cached_get(session, url, params=params) as response:
+            data = utils.json_loads(await response.read())
+    """
+    yield await _fetch_cached(session, url, params, headers, timeout, expire, limiter, http2)
@@ -1,21 +1,21 @@
 # downloaders/mdpi.py
-import os, json, random, asyncio, re
+import os, asyncio, re
 from typing import Tuple, List, Dict, Optional
 import aiohttp
 from bs4 import BeautifulSoup
 from urllib.parse import quote_plus
 from .base_downloader import BaseDownloader
-from . import utils
+from . import utils, http_client
 
-USER_AGENTS = ["Mozilla/5.0 (Research; TDM) Chrome/120.0 Academic/TDM"]
 
 class MdpiDownloader(BaseDownloader):
-    async def download(self, session: aiohttp.ClientSession, doi: str, publisher_dir: str) -> Tuple[bool, List[str], str]:
+    async def download(self, session: Optional[aiohttp.ClientSession], doi: str, publisher_dir: str) -> Tuple[bool, List[str], str]:
         # Download implementation here
         pass
 
-    async def search(self, session: aiohttp.ClientSession, keyword: str, year: Optional[int] = None, max_results: int = 200) -> List[Dict]:
+    async def search(self, session: Optional[aiohttp.ClientSession], keyword: str, year: Optional[int] = None, max_results: int = 200) -> List[Dict]:
         """Searches for MDPI articles using the CrossRef API."""
+        session = http_client.get_session(session)
         search_url = "https://api.crossref.org/works"
 
         filters = ["prefix:10.3390"]
@@ -32,16 +32,16 @@ class MdpiDownloader(BaseDownloader):
 
         try:
             print(f"  - [MDPI/CrossRef Search] Searching for '{keyword}' (Year: {year or 'All'})")
-            async with session.get(search_url, params=params, timeout=30) as response:
+            async with http_client.cached_get(session, search_url, params=params, timeout=30, http2=True) as response:
                 if response.status != 200:
                     print(f"  - [MDPI/CrossRef Search] API Error: HTTP {response.status}")
                     return []
 
-                data = await response.json()
+                data = utils.json_loads(await response.read())
                 articles = []
 
                 for item in data.get('message', {}).get('items', []):
-                    authors_list = [f"{author.get('given', '')} {author.get('family', '')}".strip() for author in item.get('author', [])]
+                    authors_list = utils.crossref_author_names(item.get('author'))
                     
                     extracted_year = 'N/A'
                     if 'published' in item and item['published']['date-parts']:
@@ -52,7 +52,7 @@ class MdpiDownloader(BaseDownloader):
                         'title': ''.join(item.get('title', ['No Title'])),
                         'authors': authors_list, 'editor': 'MDPI',
                         'year': extracted_year,
-                        'abstract': item.get('abstract', 'No abstract available.').replace('<jats:p>', '').replace('</jats:p>', '').strip(),
+                        'abstract': utils.strip_jats_p(item.get('abstract', 'No abstract available.')),
                         'keywords': item.get('subject', [])
                     }
                     articles.append(standardized_article)
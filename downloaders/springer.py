@@ -1,84 +1,107 @@
 # downloaders/springer.py
-import os, json, random, asyncio, re, xml.etree.ElementTree as ET
-from typing import Tuple, List, Dict, Optional
+import os, asyncio
+from io import BytesIO
+from typing import Tuple, List, Dict, Optional, Union
 import aiohttp
+from lxml import etree
 from urllib.parse import quote_plus
 from .base_downloader import BaseDownloader
-from . import utils
+from . import utils, http_client
+from ._doi_cache import cached_by_doi, is_definitive_miss
 
 # API Key
 SPRINGER_API_KEY = os.getenv("SPRINGER_API_KEY") 
-USER_AGENTS = ["Mozilla/5.0 (Research; TDM) Chrome/120.0 Academic/TDM"]
+
+# api.springernature.com (metadata + JATS); i PDF arrivano da link.springer.com e non sono limitati qui
+_SPRINGER_LIMITER = utils.RateLimiter(5, 1.0)
 
 class SpringerDownloader(BaseDownloader):
     def _extract_enhanced_metadata_from_jats(self, jats_xml: str, doi: str) -> Dict:
         try:
-            jats_xml = re.sub(' xmlns="[^"]+"', '', jats_xml, count=1)
-            root = ET.fromstring(jats_xml)
-            abstract_elem = root.find('.//abstract')
-            if abstract_elem is not None:
+            # Ci serve solo il primo <abstract> (in qualunque namespace): ci si ferma lì
+            # senza costruire l'albero del resto dell'articolo
+            for _, abstract_elem in etree.iterparse(BytesIO(jats_xml.encode('utf-8')), events=('end',),
+                                                     tag='{*}abstract', recover=True, huge_tree=True):
                 return {'abstract': ''.join(abstract_elem.itertext()).strip()}
         except Exception:
             return {}
         return {}
 
-    async def _fetch_full_metadata(self, session: aiohttp.ClientSession, doi: str) -> Dict:
-        if not doi or not SPRINGER_API_KEY: return {}
+    @cached_by_doi("springer")
+    async def _fetch_full_metadata(self, session: aiohttp.ClientSession, doi: str) -> Optional[Dict]:
+        if not doi or not SPRINGER_API_KEY: return None
         jats_url = f"https://api.springernature.com/openaccess/jats?q=doi:\"{doi}\"&api_key={SPRINGER_API_KEY}"
-        headers = {"User-Agent": random.choice(USER_AGENTS)}
+        headers = {"User-Agent": utils.UA}
         try:
-            await asyncio.sleep(0.5)
+            await _SPRINGER_LIMITER.acquire()
             async with session.get(jats_url, headers=headers, timeout=20) as response:
                 if response.status == 200:
                     content = await response.text()
                     if '<article' in content:
                         return self._extract_enhanced_metadata_from_jats(content, doi)
+                    return {}
+                return {} if is_definitive_miss(response.status) else None
         except Exception:
-            pass
-        return {}
+            return None
 
-    async def download(self, session: aiohttp.ClientSession, doi: str, publisher_dir: str) -> Tuple[bool, List[str], str]:
-        formats_downloaded = []
-        headers = {"User-Agent": random.choice(USER_AGENTS), "Accept": "application/xml, */*"}
+    async def download(self, session: Optional[aiohttp.ClientSession], doi: str, publisher_dir: str) -> Tuple[bool, List[str], str]:
+        session = http_client.get_session(session)
+        headers = {"User-Agent": utils.UA, "Accept": "application/xml, */*"}
 
-        # 1. JATS XML Full Text API
-        if SPRINGER_API_KEY:
-            jats_url = f"https://api.springernature.com/openaccess/jats?q=doi:\"{doi}\"&api_key={SPRINGER_API_KEY}"
-            try:
-                await asyncio.sleep(0.8)
-                async with session.get(jats_url, headers=headers, timeout=30) as response:
-                    if response.status == 200:
-                        content = await response.text()
-                        if ('<article' in content) and len(content) > 2000:
-                            xml_path = os.path.join(publisher_dir, 'xml', f"{utils.sanitize_filename(doi)}.xml")
-                            with open(xml_path, 'w', encoding='utf-8') as f: f.write(content)
-                            formats_downloaded.append('xml')
-                            
-                            json_data = self._extract_enhanced_metadata_from_jats(content, doi)
-                            if json_data:
-                                json_path = os.path.join(publisher_dir, 'json', f"{utils.sanitize_filename(doi)}.json")
-                                with open(json_path, 'w', encoding='utf-8') as f: json.dump(json_data, f, indent=2)
-                                formats_downloaded.append('json')
-            except Exception as e:
-                print(f"  - Springer JATS error: {e}")
+        # JATS (api.springernature.com) e PDF (link.springer.com) in parallelo
+        results = await asyncio.gather(
+            self._fetch_jats(session, headers, doi, publisher_dir),
+            self._fetch_pdf(session, headers, doi, publisher_dir),
+            return_exceptions=True,
+        )
+        formats_downloaded = [fmt for formats in results if isinstance(formats, list) for fmt in formats]
+        if formats_downloaded:
+            return True, sorted(list(set(formats_downloaded))), "success"
+        return False, [], utils.PAYWALLED if utils.PAYWALLED in results else "failed"
+
+    async def _fetch_jats(self, session: aiohttp.ClientSession, headers: Dict, doi: str, publisher_dir: str) -> List[str]:
+        """JATS XML Full Text API: saves the xml and, if an abstract is found, a json."""
+        formats_downloaded = []
+        if not SPRINGER_API_KEY:
+            return formats_downloaded
+        jats_url = f"https://api.springernature.com/openaccess/jats?q=doi:\"{doi}\"&api_key={SPRINGER_API_KEY}"
+        try:
+            await _SPRINGER_LIMITER.acquire()
+            async with session.get(jats_url, headers=headers, timeout=30) as response:
+                if response.status == 200:
+                    content = await response.text()
+                    if ('<article' in content) and len(content) > 2000:
+                        xml_path = utils.output_path(publisher_dir, 'xml', doi)
+                        await utils.write_text(xml_path, content)
+                        formats_downloaded.append('xml')
+                        
+                        json_data = self._extract_enhanced_metadata_from_jats(content, doi)
+                        if json_data:
+                            json_path = utils.output_path(publisher_dir, 'json', doi)
+                            await utils.write_bytes(json_path, utils.json_dumps(json_data))
+                            formats_downloaded.append('json')
+        except Exception as e:
+            print(f"  - Springer JATS error: {e}")
+        return formats_downloaded
 
-        # 2. PDF Download
-        pdf_url = f"https://link.springer.com/content/pdf/{quote_plus(doi)}.pdf"
+    async def _fetch_pdf(self, session: aiohttp.ClientSession, headers: Dict, doi: str, publisher_dir: str) -> Union[List[str], str]:
+        """['pdf'] if saved as a valid PDF, utils.PAYWALLED on 402/403, else []."""
+        pdf_url = f"https://link.springer.com/content/pdf/{utils.quote_doi(doi)}.pdf"
         try:
             async with session.get(pdf_url, headers={**headers, "Accept": "application/pdf"}, timeout=25) as response:
+                if response.status in utils.PAYWALL_STATUSES:
+                    return utils.PAYWALLED
                 if response.status == 200:
-                    content = await response.read()
-                    is_valid, _, _ = utils.validate_pdf_multi_library(content, doi)
+                    pdf_path = utils.output_path(publisher_dir, 'pdf', doi)
+                    is_valid, _, _ = await utils.stream_pdf(response, pdf_path, doi)
                     if is_valid:
-                        pdf_path = os.path.join(publisher_dir, 'pdf', f"{utils.sanitize_filename(doi)}.pdf")
-                        with open(pdf_path, 'wb') as f: f.write(content)
-                        formats_downloaded.append('pdf')
+                        return ['pdf']
         except Exception as e:
             print(f"  - Springer PDF error: {e}")
-            
-        return len(formats_downloaded) > 0, sorted(list(set(formats_downloaded))), "success" if formats_downloaded else "failed"
+        return []
 
-    async def search(self, session: aiohttp.ClientSession, keyword: str, year: Optional[int] = None, max_results: int = 200) -> List[Dict]:
+    async def search(self, session: Optional[aiohttp.ClientSession], keyword: str, year: Optional[int] = None, max_results: int = 200) -> List[Dict]:
+        session = http_client.get_session(session)
         if not SPRINGER_API_KEY:
             print("  - [Springer Search] API key (SPRINGER_API_KEY) not set. Skipping search.")
             return []
@@ -88,34 +111,37 @@ class SpringerDownloader(BaseDownloader):
             query += f' AND year:{year}'
 
         search_url = f"https://api.springernature.com/metadata/json?q=({query})&p={max_results}&api_key={SPRINGER_API_KEY}"
-        headers = {"User-Agent": random.choice(USER_AGENTS)}
+        headers = {"User-Agent": utils.UA}
         
         try:
             print(f"  - [Springer Search] Step 1: Searching for '{keyword}' (Year: {year or 'All'})")
-            async with session.get(search_url, headers=headers, timeout=30) as response:
+            async with http_client.cached_get(session, search_url, headers=headers, timeout=30,
+                                              limiter=_SPRINGER_LIMITER) as response:
                 if response.status != 200:
                     print(f"  - [Springer Search] API Error: HTTP {response.status} - Check your SPRINGER_API_KEY.")
                     return []
 
-                data = await response.json()
-                articles_to_enrich = []
+                data = utils.json_loads(await response.read())
+                # L'arricchimento di ogni articolo viene preparato nello stesso passaggio del parsing
+                articles_to_enrich, tasks = [], []
                 
                 for record in data.get('records', []):
                     pub_date = record.get('publicationDate', 'N/A')
                     extracted_year = pub_date.split('-')[0] if pub_date else 'N/A'
+                    doi = record.get('doi', '')
                     articles_to_enrich.append({
-                        'doi': record.get('doi', ''),
+                        'doi': doi,
                         'title': record.get('title', 'No Title'),
                         'authors': [creator.get('creator') for creator in record.get('creators', [])],
                         'editor': 'Springer', 'year': extracted_year,
                         'keywords': [kw['keyword'] for kw in record.get('keyword', []) if isinstance(kw, dict)]
                     })
+                    tasks.append(self._fetch_full_metadata(session, doi))
                 
                 if not articles_to_enrich: return []
                 
                 print(f"  - [Springer Search] Step 2: Enriching {len(articles_to_enrich)} articles.")
-                tasks = [self._fetch_full_metadata(session, article['doi']) for article in articles_to_enrich]
-                metadata_results = await asyncio.gather(*tasks)
+                metadata_results = await utils.bounded_gather(tasks)
 
                 enriched_articles = []
                 for i, article in enumerate(articles_to_enrich):
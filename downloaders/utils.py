@@ -1,38 +1,322 @@
 # downloaders/utils.py
 
 import fitz # PyMuPDF
-import pdfplumber
-import PyPDF2
 from io import BytesIO
+import json
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import re
-from typing import Tuple
+import time
+from functools import lru_cache
+from urllib.parse import quote_plus
+from typing import Any, Awaitable, Iterable, List, Optional, Set, Tuple, Union
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 # Costanti di validazione
 MIN_PDF_PAGES = 3
 MIN_PDF_SIZE_BYTES = 30000
 MIN_TEXT_CONTENT = 300
 
-# Disponibilità delle librerie
+# Con PARSAL_STRICT_PDF_VALIDATION=1 ogni PDF passa dalla validazione completa (fitz/pdfplumber/PyPDF2)
+# anche quando il controllo veloce a livello di byte basterebbe
+STRICT_PDF_VALIDATION = os.getenv("PARSAL_STRICT_PDF_VALIDATION", "").lower() in ("1", "true", "yes")
+
+# 402/403 sul full text = non disponibile via TDM per questa chiave/istituzione:
+# risposta definitiva, inutile riprovare o insistere con gli altri formati
+PAYWALL_STATUSES = frozenset({402, 403})
+PAYWALLED = "paywalled"
+
+# Richieste di arricchimento (metadati per DOI) in volo contemporaneamente per ricerca
+ENRICH_CONCURRENCY = 8
+
+# User-Agent unico per tutte le richieste (API TDM e download)
+UA = "Mozilla/5.0 (Research; TDM) Chrome/120.0 Academic/TDM"
+DEFAULT_HEADERS = {"User-Agent": UA}
+
+# Cache locale (indici, metadati) condivisa tra le esecuzioni
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "parsal")
+
+# Disponibilità delle librerie (pdfplumber e PyPDF2 sono importati solo se PyMuPDF non basta)
 PYMUPDF_AVAILABLE = True
 PDFPLUMBER_AVAILABLE = True
 PYPDF2_AVAILABLE = True
 
+def _pdfplumber():
+    global PDFPLUMBER_AVAILABLE
+    try:
+        import pdfplumber
+        return pdfplumber
+    except ImportError:
+        PDFPLUMBER_AVAILABLE = False
+        return None
+
+def _pypdf2():
+    global PYPDF2_AVAILABLE
+    try:
+        import PyPDF2
+        return PyPDF2
+    except ImportError:
+        PYPDF2_AVAILABLE = False
+        return None
+
 # def sanitize_filename(name: str) -> str:
 #     """Rimuove i caratteri non validi per i nomi di file."""
 #     return re.sub(r'[\\/*?:"<>|]', '_', name)
 
+_UNSAFE_FILENAME_RE = re.compile(r'[\\/*?:"<>|]')
+
+# Lo stesso DOI/editore viene sanificato più volte per download (un percorso per formato)
+@lru_cache(maxsize=4096)
 def sanitize_filename(name):
     if not name:
         name = "Unknown"
-    return re.sub(r'[\\/*?:"<>|]', '_', str(name))
+    return _UNSAFE_FILENAME_RE.sub('_', str(name))
+
+@lru_cache(maxsize=8192)
+def quote_doi(doi: str) -> str:
+    """DOI codificato per l'uso in un path URL (stessa codifica ovunque, calcolata una volta)."""
+    return quote_plus(doi)
+
+# Cartelle già create in questo processo: evita makedirs (e le relative stat) ripetute
+_CREATED_DIRS: Set[str] = set()
+
+def ensure_dir(path: str) -> str:
+    """Crea la cartella (se serve) una sola volta per processo e la restituisce."""
+    if path not in _CREATED_DIRS:
+        os.makedirs(path, exist_ok=True)
+        _CREATED_DIRS.add(path)
+    return path
+
+@lru_cache(maxsize=1024)
+def _format_dir(publisher_dir: str, fmt: str) -> str:
+    # I downloader sono condivisi tra query diverse, quindi publisher_dir arriva a ogni
+    # download: la cartella di ciascun formato si calcola (e crea) una volta sola
+    return ensure_dir(os.path.join(publisher_dir, fmt))
+
+def forget_dirs(root: str) -> None:
+    """Dimentica le cartelle memorizzate sotto root (es. cancellata dall'utente durante la sessione)."""
+    prefix = os.path.join(root, '')
+    _CREATED_DIRS.difference_update([d for d in _CREATED_DIRS if d == root or d.startswith(prefix)])
+    _format_dir.cache_clear()
+
+def output_path(publisher_dir: str, fmt: str, doi: str) -> str:
+    """Percorso di output per un formato (pdf/xml/json); la sottocartella è creata solo ora."""
+    return f"{_format_dir(publisher_dir, fmt)}{os.sep}{sanitize_filename(doi)}.{fmt}"
+
+
+def _open_for_write(path: str, mode: str, **kwargs):
+    try:
+        return open(path, mode, **kwargs)
+    except FileNotFoundError:
+        # Cartella memorizzata ma cancellata nel frattempo: la si ricrea e si riprova
+        parent = os.path.dirname(path)
+        forget_dirs(parent)
+        ensure_dir(parent)
+        return open(path, mode, **kwargs)
+
+def _write_bytes(path: str, data: bytes) -> None:
+    with _open_for_write(path, 'wb') as f:
+        f.write(data)
+
+def _write_text(path: str, text: str) -> None:
+    with _open_for_write(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+async def write_bytes(path: str, data: bytes) -> None:
+    """Scrive su file in un thread: un PDF di qualche MB non blocca l'event loop."""
+    await asyncio.to_thread(_write_bytes, path, data)
+
+async def write_text(path: str, text: str) -> None:
+    await asyncio.to_thread(_write_text, path, text)
+
+
+def json_loads(data: Union[bytes, str]) -> Any:
+    """Decodifica JSON (orjson se disponibile: le risposte Scopus/CrossRef sono grandi)."""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+def json_dumps(obj: Any) -> bytes:
+    """JSON indentato, in UTF-8, pronto per write_bytes."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+# --- Parsing dei risultati CrossRef (Wiley, MDPI) ---
+_JATS_P_RE = re.compile(r'</?jats:p>')
+
+def _join_name(author: dict) -> str:
+    given, family = author.get('given'), author.get('family')
+    if given and family:
+        return f"{given} {family}".strip()
+    return (given or family or '').strip()
+
+def crossref_author_names(authors) -> List[str]:
+    """'given family' per ogni autore CrossRef, saltando quelli senza nome."""
+    return [name for name in map(_join_name, authors or ()) if name]
+
+def strip_jats_p(text: str) -> str:
+    return _JATS_P_RE.sub('', text).strip()
 
 
+PDF_CHUNK_SIZE = 64 * 1024
 
-def validate_pdf_multi_library(pdf_content: bytes, doi: str) -> Tuple[bool, int, str]:
-    """Valida un PDF usando più librerie per robustezza."""
-    if not pdf_content or not pdf_content.startswith(b'%PDF-'):
+# Oggetto pagina: /Type /Page ma non /Pages, /PageLabel...
+_PAGE_OBJ_RE = re.compile(rb'/Type\s{0,4}/Page(?![A-Za-z])')
+
+class _FastPdfCheck:
+    """
+    Controllo a livello di byte, alimentato blocco per blocco: header %PDF-, dimensione minima,
+    %%EOF in coda e almeno MIN_PDF_PAGES oggetti /Type /Page. Nessun parsing: se le pagine
+    stanno in object stream compressi (PDF 1.5+) non si vedono, e il risultato resta
+    "non concluso" -> validazione completa.
+    """
+    _OVERLAP = 32    # un match può stare a cavallo tra due blocchi
+    _TAIL = 1024     # %%EOF sta negli ultimi byte
+
+    def __init__(self) -> None:
+        self.size = 0
+        self.pages = 0
+        self._head = b''
+        self._tail = b''
+        self._counted_upto = 0  # offset assoluto: i match che finiscono prima sono già contati
+
+    def feed(self, chunk: bytes) -> None:
+        if len(self._head) < 5:
+            self._head += chunk[:5 - len(self._head)]
+        carry = self._tail[-self._OVERLAP:]
+        buf = carry + chunk
+        start = self.size - len(carry)
+        limit = len(buf) - 1  # serve almeno un byte dopo il match per escludere /Pages
+        for m in _PAGE_OBJ_RE.finditer(buf):
+            if m.end() <= limit and start + m.end() > self._counted_upto:
+                self.pages += 1
+        self._counted_upto = max(self._counted_upto, start + limit)
+        self.size += len(chunk)
+        self._tail = (self._tail + chunk[-self._TAIL:])[-self._TAIL:]
+
+    def result(self) -> Tuple[bool, int]:
+        """(True, pagine) se il PDF supera il controllo; False = non concluso."""
+        ok = (self._head == b'%PDF-' and self.size >= MIN_PDF_SIZE_BYTES
+              and b'%%EOF' in self._tail and self.pages >= MIN_PDF_PAGES)
+        return ok, self.pages
+
+def fast_pdf_check(content: bytes) -> Tuple[bool, int]:
+    """Controllo veloce (<1 ms) su un PDF in memoria; se False serve validate_pdf_multi_library."""
+    check = _FastPdfCheck()
+    check.feed(content)
+    return check.result()
+
+async def stream_pdf(response, path: str, doi: str) -> Tuple[bool, int, str]:
+    """
+    Scarica il body della risposta a blocchi in `<path>.part` (niente PDF interi in RAM),
+    lo valida e solo se è valido lo rinomina in `path`. Il controllo veloce gira sui blocchi
+    mentre arrivano; la validazione completa dal file serve solo se quello non è conclusivo.
+    Restituisce lo stesso (is_valid, pages, reason) di validate_pdf_multi_library.
+    """
+    tmp_path = path + ".part"
+    header = b''
+    fast_check = _FastPdfCheck()
+    try:
+        f = await asyncio.to_thread(_open_for_write, tmp_path, 'wb')
+        try:
+            async for chunk in response.content.iter_chunked(PDF_CHUNK_SIZE):
+                if len(header) < 5:
+                    header += chunk[:5 - len(header)]
+                    if not b'%PDF-'.startswith(header):
+                        break  # pagina HTML (login, paywall...): inutile scaricare il resto
+                fast_check.feed(chunk)
+                await asyncio.to_thread(f.write, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+
+        fast_ok, fast_pages = fast_check.result()
+        if header != b'%PDF-':
+            result = (False, 0, "invalid_header")
+        elif fast_ok and not STRICT_PDF_VALIDATION:
+            result = (True, fast_pages, "valid_fast")
+        else:
+            result = await validate_pdf_async(tmp_path, doi)
+        if result[0]:
+            os.replace(tmp_path, path)
+        return result
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class RateLimiter:
+    """
+    Token bucket asincrono: al massimo `max_rate` richieste ogni `time_period` secondi.
+    Aspetta solo quando il ritmo viene davvero superato (la prima richiesta parte subito).
+    Non conserva future né lock, quindi si può usare come globale di modulo
+    anche tra più asyncio.run() successivi.
+
+        async with LIMITER:
+            async with session.get(...) as response: ...
+    """
+
+    def __init__(self, max_rate: float, time_period: float = 1.0) -> None:
+        self.max_rate = max_rate
+        self._rate = max_rate / time_period  # token rigenerati al secondo
+        self._tokens = float(max_rate)
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_rate, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        # Il token si prenota subito: chi arriva dopo trova il conto già scalato
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self._rate)
+
+    async def __aenter__(self) -> "RateLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> bool:
+        return False
+
+
+async def bounded_gather(aws: Iterable[Awaitable], limit: int = ENRICH_CONCURRENCY) -> List:
+    """
+    Come asyncio.gather, ma con al massimo `limit` awaitable in esecuzione alla volta.
+    Il semaforo nasce dentro la chiamata, quindi è legato al loop corrente.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws))
+
+
+
+def validate_pdf_multi_library(pdf_content: Union[bytes, str], doi: str) -> Tuple[bool, int, str]:
+    """Valida un PDF (contenuto in memoria o percorso su disco) usando più librerie per robustezza."""
+    from_file = isinstance(pdf_content, str)
+    if from_file:
+        try:
+            size = os.path.getsize(pdf_content)
+            with open(pdf_content, 'rb') as f:
+                header = f.read(5)
+        except OSError:
+            return False, 0, "invalid_header"
+    else:
+        pdf_content = pdf_content or b''
+        size, header = len(pdf_content), pdf_content[:5]
+
+    if header != b'%PDF-':
         return False, 0, "invalid_header"
-    if len(pdf_content) < MIN_PDF_SIZE_BYTES:
+    if size < MIN_PDF_SIZE_BYTES:
         return False, 0, "too_small"
 
     page_count = 0
@@ -40,31 +324,57 @@ def validate_pdf_multi_library(pdf_content: bytes, doi: str) -> Tuple[bool, int,
 
     if PYMUPDF_AVAILABLE:
         try:
-            with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+            with (fitz.open(pdf_content, filetype="pdf") if from_file
+                  else fitz.open(stream=pdf_content, filetype="pdf")) as doc:
                 page_count = len(doc)
-                if page_count >= MIN_PDF_PAGES:
-                    text_sample = "".join(doc[i].get_text() for i in range(min(3, page_count)))
-                    if len(text_sample.strip()) > MIN_TEXT_CONTENT:
-                        return True, page_count, "valid_pymupdf"
+                if doc.is_pdf and page_count >= MIN_PDF_PAGES:
+                    # Si estrae testo pagina per pagina (max 3) solo finché non basta
+                    text_len = 0
+                    for i in range(min(3, page_count)):
+                        text_len += len(doc[i].get_text().strip())
+                        if text_len > MIN_TEXT_CONTENT:
+                            return True, page_count, "valid_pymupdf"
         except Exception:
             pass
 
-    if PDFPLUMBER_AVAILABLE:
+    if PDFPLUMBER_AVAILABLE and (pdfplumber := _pdfplumber()):
         try:
-            with pdfplumber.open(BytesIO(pdf_content)) as pdf:
+            with pdfplumber.open(pdf_content if from_file else BytesIO(pdf_content)) as pdf:
                 page_count = len(pdf.pages)
                 if page_count >= MIN_PDF_PAGES:
                      return True, page_count, "valid_pdfplumber"
         except Exception:
             pass
             
-    if PYPDF2_AVAILABLE:
+    if PYPDF2_AVAILABLE and (PyPDF2 := _pypdf2()):
         try:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_content), strict=False)
+            pdf_reader = PyPDF2.PdfReader(pdf_content if from_file else BytesIO(pdf_content), strict=False)
             page_count = len(pdf_reader.pages)
             if page_count >= MIN_PDF_PAGES:
                 return True, page_count, "valid_pypdf2"
         except Exception:
             pass
             
-    return False, page_count, "validation_failed"
\ No newline at end of file
+    return False, page_count, "validation_failed"
+
+
+# Pool di processi per la validazione: il parsing con fitz è CPU e terrebbe fermo
+# l'event loop (e quindi tutti gli altri download) per decine/centinaia di ms.
+# Si passa il percorso del file, non i byte, così non c'è nulla di grosso da serializzare.
+_VALIDATOR_POOL: Optional[ProcessPoolExecutor] = None
+
+def _get_validator_pool() -> ProcessPoolExecutor:
+    global _VALIDATOR_POOL
+    if _VALIDATOR_POOL is None:
+        _VALIDATOR_POOL = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2))
+    return _VALIDATOR_POOL
+
+async def validate_pdf_async(pdf_content: Union[bytes, str], doi: str) -> Tuple[bool, int, str]:
+    """validate_pdf_multi_library eseguita fuori dall'event loop."""
+    global _VALIDATOR_POOL
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_validator_pool(), validate_pdf_multi_library, pdf_content, doi)
+    except BrokenProcessPool:
+        _VALIDATOR_POOL = None  # un worker è morto (es. crash di MuPDF): al prossimo giro si ricrea
+        return await asyncio.to_thread(validate_pdf_multi_library, pdf_content, doi)
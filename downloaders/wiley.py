@@ -1,56 +1,75 @@
 # downloaders/wiley.py
-import os, json, random, asyncio
+import os, asyncio
 from typing import Tuple, List, Dict, Optional
 import aiohttp
-from urllib.parse import quote_plus
 from .base_downloader import BaseDownloader
-from . import utils
+from . import utils, http_client
 
 
 WILEY_TDM_TOKEN = os.getenv("WILEY_TDM_TOKEN")
 #WILEY_TDM_TOKEN = os.getenv("WILEY_TDM_TOKEN", "MANUAL WILEY TOKEN")
-USER_AGENTS = ["Mozilla/5.0 (Research; TDM) Chrome/120.0 Academic/TDM"]
+
+# Wiley TDM API: al massimo 3 richieste al secondo
+_WILEY_LIMITER = utils.RateLimiter(3, 1.0)
 
 class WileyDownloader(BaseDownloader):
-    async def download(self, session: aiohttp.ClientSession, doi: str, publisher_dir: str) -> Tuple[bool, List[str], str]:
+    async def download(self, session: Optional[aiohttp.ClientSession], doi: str, publisher_dir: str) -> Tuple[bool, List[str], str]:
+        session = http_client.get_session(session)
         if not WILEY_TDM_TOKEN:
             return False, [], "api_key_missing"
         
-        formats_downloaded = []
-        headers = {"Wiley-TDM-Client-Token": WILEY_TDM_TOKEN, "User-Agent": random.choice(USER_AGENTS)}
-        tdm_url = f"https://api.wiley.com/onlinelibrary/tdm/v1/articles/{quote_plus(doi)}"
+        headers = {"Wiley-TDM-Client-Token": WILEY_TDM_TOKEN, "User-Agent": utils.UA}
+        tdm_url = f"https://api.wiley.com/onlinelibrary/tdm/v1/articles/{utils.quote_doi(doi)}"
         
+        # PDF e JSON partono insieme, ma il JSON serve solo se il PDF è valido:
+        # se il PDF manca (o è a pagamento, 402/403) la richiesta del JSON viene annullata
+        json_task = asyncio.ensure_future(self._fetch_json(session, tdm_url, headers))
         try:
-            # 1. PDF Download
-            await asyncio.sleep(random.uniform(1.5, 2.5))
-            async with session.get(tdm_url, headers={**headers, "Accept": "application/pdf"}, timeout=35) as response:
-                if response.status == 200:
-                    content = await response.read()
-                    is_valid, pages, _ = utils.validate_pdf_multi_library(content, doi)
-                    if is_valid:
-                        pdf_path = os.path.join(publisher_dir, 'pdf', f"{utils.sanitize_filename(doi)}.pdf")
-                        with open(pdf_path, 'wb') as f: f.write(content)
-                        formats_downloaded.append('pdf')
-                else:
-                    print(f"  - [Wiley Download] PDF download failed with status: {response.status}")
+            pdf_result = await self._fetch_pdf(session, tdm_url, headers, doi, publisher_dir)
+        except Exception as e:
+            json_task.cancel()
+            return False, [], f"wiley_error: {str(e)[:30]}"
+        if pdf_result != 'pdf':
+            json_task.cancel()
+            return False, [], pdf_result or "failed"
 
-            # 2. JSON Metadata (only if PDF succeeded)
-            if 'pdf' in formats_downloaded:
-                await asyncio.sleep(1.0)
-                async with session.get(tdm_url, headers={**headers, "Accept": "application/json"}, timeout=30) as json_response:
-                    if json_response.status == 200:
-                        json_data = await json_response.json()
-                        if json_data:
-                            json_path = os.path.join(publisher_dir, 'json', f"{utils.sanitize_filename(doi)}.json")
-                            with open(json_path, 'w', encoding='utf-8') as f: json.dump(json_data, f, indent=2)
-                            formats_downloaded.append('json')
+        formats_downloaded = ['pdf']
+        json_result = await json_task
+        if json_result:
+            try:
+                json_path = utils.output_path(publisher_dir, 'json', doi)
+                await utils.write_bytes(json_path, utils.json_dumps(json_result))
+                formats_downloaded.append('json')
+            except Exception as e:
+                print(f"  - [Wiley Download] JSON write error: {e}")
 
-            return len(formats_downloaded) > 0, sorted(list(set(formats_downloaded))), "success" if formats_downloaded else "failed"
+        return True, sorted(formats_downloaded), "success"
 
+    async def _fetch_pdf(self, session: aiohttp.ClientSession, tdm_url: str, headers: Dict, doi: str, publisher_dir: str) -> Optional[str]:
+        """Streams the PDF to disk: 'pdf' if saved as a valid PDF, utils.PAYWALLED on 402/403, else None."""
+        await _WILEY_LIMITER.acquire()
+        async with session.get(tdm_url, headers={**headers, "Accept": "application/pdf"}, timeout=35) as response:
+            if response.status == 200:
+                pdf_path = utils.output_path(publisher_dir, 'pdf', doi)
+                is_valid, pages, _ = await utils.stream_pdf(response, pdf_path, doi)
+                return 'pdf' if is_valid else None
+            print(f"  - [Wiley Download] PDF download failed with status: {response.status}")
+            if response.status in utils.PAYWALL_STATUSES:
+                return utils.PAYWALLED
+        return None
+
+    async def _fetch_json(self, session: aiohttp.ClientSession, tdm_url: str, headers: Dict) -> Optional[Dict]:
+        try:
+            await _WILEY_LIMITER.acquire()
+            async with session.get(tdm_url, headers={**headers, "Accept": "application/json"}, timeout=30) as json_response:
+                if json_response.status == 200:
+                    return utils.json_loads(await json_response.read())
         except Exception as e:
-            return False, [], f"wiley_error: {str(e)[:30]}"
+            print(f"  - [Wiley Download] JSON error: {e}")
+        return None
 
-    async def search(self, session: aiohttp.ClientSession, keyword: str, year: Optional[int] = None, max_results: int = 200) -> List[Dict]:
+    async def search(self, session: Optional[aiohttp.ClientSession], keyword: str, year: Optional[int] = None, max_results: int = 200) -> List[Dict]:
+        session = http_client.get_session(session)
         search_url = "https://api.crossref.org/works"
         
         filters = ["prefix:10.1002,prefix:10.1111"]
@@ -66,16 +85,16 @@ class WileyDownloader(BaseDownloader):
         
         try:
             print(f"  - [Wiley/CrossRef Search] Searching for '{keyword}' (Year: {year or 'All'})")
-            async with session.get(search_url, params=params, timeout=30) as response:
+            async with http_client.cached_get(session, search_url, params=params, timeout=30, http2=True) as response:
                 if response.status != 200:
                     print(f"  - [Wiley/CrossRef Search] API Error: HTTP {response.status}")
                     return []
 
-                data = await response.json()
+                data = utils.json_loads(await response.read())
                 articles = []
 
                 for item in data.get('message', {}).get('items', []):
-                    authors_list = [f"{author.get('given', '')} {author.get('family', '')}".strip() for author in item.get('author', [])]
+                    authors_list = utils.crossref_author_names(item.get('author'))
                     
                     extracted_year = 'N/A'
                     date_parts = None
@@ -91,7 +110,7 @@ class WileyDownloader(BaseDownloader):
                         'title': ''.join(item.get('title', ['No Title'])),
                         'authors': authors_list, 'editor': 'Wiley',
                         'year': extracted_year,
-                        'abstract': item.get('abstract', 'No abstract available.').replace('<jats:p>', '').replace('</jats:p>', '').strip(),
+                        'abstract': utils.strip_jats_p(item.get('abstract', 'No abstract available.')),
                         'keywords': item.get('subject', [])
                     }
                     articles.append(standardized_article)
@@ -1,13 +1,19 @@
 import os
 import glob
+import hashlib
 import json
 import base64
+import functools
 import re
 import time
 from datetime import datetime
 from io import BytesIO
 from PIL import Image
 import subprocess
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 
 # PyPDF2 to count the number of pages in the PDF
 from PyPDF2 import PdfReader
@@ -15,12 +21,51 @@ from olmocr.data.renderpdf import render_pdf_to_base64png
 from olmocr.prompts import build_finetuning_prompt
 from olmocr.prompts.anchor import get_anchor_text
 
+# pypdfium2 renders straight to a PIL image, without olmocr's PNG -> base64 -> PNG round-trip
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
 
 os.environ["PATH"] = "/home/gsciortino/.conda/envs/olmocr_env/bin:" + os.environ.get("PATH", "")
 
 # Import PyTorch and HuggingFace modules
 import torch
-from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+from transformers import AutoProcessor, Qwen2VLForConditionalGeneration, StoppingCriteria, StoppingCriteriaList
+
+# TF32 matmuls on Ampere+ and cuDNN autotuning for the vision tower
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.benchmark = True
+
+# FlashAttention-2 if the flash-attn package is installed, otherwise PyTorch's fused SDPA kernels
+try:
+    import flash_attn  # noqa: F401
+    ATTN_IMPLEMENTATION = "flash_attention_2"
+except ImportError:
+    ATTN_IMPLEMENTATION = "sdpa"
+
+# diskcache (optional): keeps the anchor text of each page across runs
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+
+# orjson (optional): faster parsing of the JSON the model returns for every page
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# vLLM (optional): continuous batching and paged KV cache instead of HF generate
+try:
+    from vllm import LLM, SamplingParams
+    VLLM_AVAILABLE = True
+except ImportError:
+    VLLM_AVAILABLE = False
 
 # --- Configuration
 # 'mode': 'single' to process a single PDF, or 'batch' to process an entire folder.
@@ -33,65 +78,462 @@ config = {
     "output_path": "/home/gsciortino/OCR/olmOCR/output_text_olmOCR",  # Output directory for .txt files
     "max_new_tokens": 5000,  # Maximum number of tokens generated per page
     "target_longest_image_dim": 1024,  # Maximum dimension for image rendering
+    "batch_size": 4,  # Pages sent to model.generate together (lower it if you run out of GPU memory)
+    "compile_model": True,  # torch.compile + static KV cache (slow first batch, faster afterwards)
+    "use_cache": True,  # Reuse the model output of pages already processed (cache in output_path/.cache)
+    "backend": "hf",  # 'hf' (transformers generate) or 'vllm' (needs the vllm package; use a larger batch_size, e.g. 32)
+    "vllm_gpu_memory_utilization": 0.9,  # Fraction of GPU memory vLLM may take for weights + KV cache
+    "vllm_max_num_batched_tokens": 8192,  # Tokens vLLM schedules per step
+    "quantization": None,  # None (bf16 weights), 'int8' (hf backend, needs bitsandbytes) or 'fp8' (vllm backend, Ada/Hopper GPUs)
     "page_processing": True  # If True, process all pages of the PDF
 }
 
+MODEL_NAME = "allenai/olmOCR-7B-0225-preview"
+
+BACKEND = config["backend"]
+if BACKEND == "vllm" and not VLLM_AVAILABLE:
+    print(f"[{datetime.now()}] vllm is not installed, falling back to the 'hf' backend.")
+    BACKEND = "hf"
+
+# Weight quantization halves the weight reads that dominate decoding; each backend supports its own scheme
+QUANTIZATION = config["quantization"]
+if QUANTIZATION not in (None, {"hf": "int8", "vllm": "fp8"}[BACKEND]):
+    print(f"[{datetime.now()}] Quantization '{QUANTIZATION}' is not supported by the '{BACKEND}' backend, using bf16 weights.")
+    QUANTIZATION = None
+
 # Initialize olmOCR model
-print(f"[{datetime.now()}] Initializing olmOCR model...")
-model = Qwen2VLForConditionalGeneration.from_pretrained(
-    "allenai/olmOCR-7B-0225-preview", torch_dtype=torch.bfloat16
-).eval().to("cuda")
-processor = AutoProcessor.from_pretrained("Qwen/Qwen2-VL-7B-Instruct")
+if BACKEND == "vllm":
+    print(f"[{datetime.now()}] Initializing olmOCR model (vLLM)...")
+    # The model is loaded at import time: keep the engine in this process, a spawned
+    # engine process would re-import this script
+    os.environ.setdefault("VLLM_ENABLE_V1_MULTIPROCESSING", "0")
+    llm = LLM(
+        model=MODEL_NAME,
+        dtype="bfloat16",
+        gpu_memory_utilization=config["vllm_gpu_memory_utilization"],
+        max_num_batched_tokens=config["vllm_max_num_batched_tokens"],
+        enable_prefix_caching=True,  # the prompt template is the same for every page
+        quantization=QUANTIZATION,  # 'fp8': weights quantized on the fly at load time
+    )
+    model = None
+else:
+    print(f"[{datetime.now()}] Initializing olmOCR model ({ATTN_IMPLEMENTATION} attention)...")
+    if QUANTIZATION == "int8":
+        from transformers import BitsAndBytesConfig
+        # bitsandbytes models are placed on the GPU at load time and cannot be moved with .to()
+        model = Qwen2VLForConditionalGeneration.from_pretrained(
+            MODEL_NAME, torch_dtype=torch.bfloat16, attn_implementation=ATTN_IMPLEMENTATION,
+            quantization_config=BitsAndBytesConfig(load_in_8bit=True), device_map="cuda"
+        ).eval()
+    else:
+        model = Qwen2VLForConditionalGeneration.from_pretrained(
+            MODEL_NAME, torch_dtype=torch.bfloat16, attn_implementation=ATTN_IMPLEMENTATION
+        ).eval().to("cuda")
+    if config["compile_model"]:
+        # The static cache keeps the KV shapes fixed, so the compiled graph is reused across batches
+        model.generation_config.cache_implementation = "static"
+        model.forward = torch.compile(model.forward, mode="max-autotune", fullgraph=False)
+# use_fast: the torchvision image processor resizes/normalizes the whole batch as tensors instead of per-image PIL/numpy
+processor = AutoProcessor.from_pretrained("Qwen/Qwen2-VL-7B-Instruct", use_fast=True)
+# Left padding: in a batch every prompt must end right where generation starts
+processor.tokenizer.padding_side = "left"
+# Tokens that can open/close the JSON of a page: the only ones the stopping criterion needs to look at.
+# Byte-level BPE keeps ASCII characters as they are, so a lookup table is enough (no decoding while generating).
+JSON_TOKENS = {
+    token_id: token
+    for token_id, token in enumerate(processor.tokenizer.convert_ids_to_tokens(range(len(processor.tokenizer))))
+    if token and any(c in token for c in '{}"\\')
+}
 print(f"[{datetime.now()}] Model and processor loaded.")
 
 
-# Process all pages in a PDF
-def process_pdf_allpages(pdf_path, max_new_tokens, target_longest_image_dim):
+# Three-stage pipeline: render (CPU) -> prompt + tokenization (CPU) -> generate (GPU).
+# The bounded queues let the CPU prepare the next pages while the GPU runs the current batch.
+RENDER_QUEUE_SIZE = 8
+INFER_QUEUE_SIZE = 4
+_DONE = object()  # end-of-stream marker passed between the stages
+# Prompt lengths are rounded up to a multiple of this, so the compiled model sees few distinct shapes
+PROMPT_PAD_MULTIPLE = 128 if config["compile_model"] and BACKEND == "hf" else None
+# The fast tokenizer is not safe for concurrent padding (stage 2) and decoding (stage 3)
+_tokenizer_lock = threading.Lock()
+# Side stream for host->device copies, so they overlap the generate running on the default stream
+_copy_stream = torch.cuda.Stream()
+
+
+# On-disk cache of the raw model output per page, keyed on the page image and anchor text.
+# One folder per model (and quantization), so changing model never returns stale outputs.
+CACHE_DIR = os.path.join(config["output_path"], ".cache", MODEL_NAME.replace("/", "_") + (f"_{QUANTIZATION}" if QUANTIZATION else ""))
+
+
+def page_cache_path(image, anchor_text, max_new_tokens):
+    image_hash = hashlib.sha256(f"{image.size}".encode() + image.tobytes()).hexdigest()
+    anchor_hash = hashlib.sha256(anchor_text.encode()).hexdigest()
+    return os.path.join(CACHE_DIR, str(max_new_tokens), f"{image_hash}_{anchor_hash}.json")
+
+
+def load_cached_output(cache_path):
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)["raw_page_output"]
+    except Exception:
+        return None
+
+
+def store_cached_output(cache_path, raw_page_output):
+    if not cache_path:
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"raw_page_output": raw_page_output}, f)
+        os.replace(tmp_path, cache_path)  # atomic: a concurrent run never reads half a file
+    except Exception as e:
+        print(f"[{datetime.now()}] Could not write OCR cache {cache_path}: {e}")
+
+
+# Anchor text per (PDF, modification time, page): pdfreport re-parses the page layout on every call.
+# Kept in memory and, with diskcache, on disk, so re-runs on the same PDFs skip it; editing a PDF changes its mtime.
+ANCHOR_TARGET_LENGTH = 4000
+_anchor_disk_cache = (diskcache.Cache(os.path.join(config["output_path"], ".cache", "anchors"))
+                      if DISKCACHE_AVAILABLE and config["use_cache"] else None)
+
+
+@functools.lru_cache(maxsize=4096)
+def _anchor_cached(pdf_path, mtime, page_number, target_length):
+    key = (pdf_path, mtime, page_number, target_length)
+    if _anchor_disk_cache is not None:
+        anchor_text = _anchor_disk_cache.get(key)
+        if anchor_text is not None:
+            return anchor_text
+    anchor_text = get_anchor_text(pdf_path, page_number, pdf_engine="pdfreport", target_length=target_length)
+    if _anchor_disk_cache is not None:
+        _anchor_disk_cache.set(key, anchor_text)
+    return anchor_text
+
+
+def get_page_anchor_text(pdf_path, page_number, target_length=ANCHOR_TARGET_LENGTH):
+    return _anchor_cached(os.path.abspath(pdf_path), os.path.getmtime(pdf_path), page_number, target_length)
+
+
+# Render one page to a PIL image whose longest side is target_longest_image_dim
+def render_page_image(pdf_path, page_number, target_longest_image_dim):
+    if not PDFIUM_AVAILABLE:
+        image_b64 = render_pdf_to_base64png(pdf_path, page_number, target_longest_image_dim=target_longest_image_dim)
+        return Image.open(BytesIO(base64.b64decode(image_b64))).convert("RGB")
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        page = pdf[page_number - 1]
+        scale = target_longest_image_dim / max(page.get_size())  # scale 1 = 72 dpi, like pdftoppm
+        return page.render(scale=scale).to_pil().convert("RGB")
+    finally:
+        pdf.close()
+
+
+# The chat template is the same for every page except for the prompt text:
+# render it once with a placeholder instead of running the Jinja template per page
+_PROMPT_SLOT = "\x00prompt\x00"
+CHAT_TEMPLATE = processor.apply_chat_template([{
+    "role": "user",
+    "content": [
+        {"type": "text", "text": _PROMPT_SLOT},
+        # The chat template only emits the image placeholder tokens: the pixels
+        # go to the processor through images=, so the URL is never read
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64,<elided>"}}
+    ]
+}], tokenize=False, add_generation_prompt=True)
+
+
+# Build the chat prompt for one page
+def build_text_input(anchor_text):
+    return CHAT_TEMPLATE.replace(_PROMPT_SLOT, build_finetuning_prompt(anchor_text), 1)
+
+
+# Tokenize a batch of (page_number, cache_path, image, text_input) on the CPU
+def tokenize_batch(batch):
+    with _tokenizer_lock:
+        return processor(
+            text=[text_input for _, _, _, text_input in batch],
+            images=[image for _, _, image, _ in batch],
+            padding=True,
+            pad_to_multiple_of=PROMPT_PAD_MULTIPLE,
+            return_tensors="pt",
+        )
+
+
+# Copy a tokenized batch to the GPU from pinned memory without blocking; returns (inputs, ready event)
+def to_gpu_async(inputs):
+    with torch.cuda.stream(_copy_stream):
+        gpu_inputs = {
+            key: value.pin_memory().to("cuda", non_blocking=True) if torch.is_tensor(value) else value
+            for key, value in inputs.items()
+        }
+        ready = torch.cuda.Event()
+        ready.record(_copy_stream)
+    return gpu_inputs, ready
+
+
+# Stops each sequence of the batch as soon as its top-level JSON object is closed,
+# instead of letting short pages run until max_new_tokens
+class JsonClosedCriteria(StoppingCriteria):
+    def __init__(self, batch_size):
+        self.states = [{"depth": 0, "in_string": False, "escape": False, "closed": False} for _ in range(batch_size)]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        for state, token_id in zip(self.states, input_ids[:, -1].tolist()):
+            if state["closed"]:
+                continue
+            token = JSON_TOKENS.get(token_id)
+            if token is None:
+                state["escape"] = False  # a plain token right after a backslash is the escaped character
+                continue
+            for c in token:
+                if state["escape"]:
+                    state["escape"] = False
+                elif state["in_string"]:
+                    if c == "\\":
+                        state["escape"] = True
+                    elif c == '"':
+                        state["in_string"] = False
+                elif c == '"':
+                    state["in_string"] = True
+                elif c == "{":
+                    state["depth"] += 1
+                elif c == "}" and state["depth"] > 0:
+                    state["depth"] -= 1
+                    if state["depth"] == 0:
+                        state["closed"] = True
+                        break
+        return torch.tensor([state["closed"] for state in self.states], dtype=torch.bool, device=input_ids.device)
+
+
+# Run the model once on a batch already sent to the GPU and return the raw outputs
+def generate_batch_hf(inputs, ready, max_new_tokens):
+    stream = torch.cuda.current_stream()
+    stream.wait_event(ready)
+    for value in inputs.values():
+        if torch.is_tensor(value):
+            value.record_stream(stream)  # allocated on _copy_stream, used here
+    # Greedy decoding: OCR wants the most likely transcription, not a sampled one
+    output = model.generate(
+        **inputs,
+        do_sample=False,
+        num_beams=1,
+        max_new_tokens=max_new_tokens,
+        use_cache=True,
+        stopping_criteria=StoppingCriteriaList([JsonClosedCriteria(inputs["input_ids"].shape[0])]),
+    )
+    # With left padding all prompts have the same length in the batch
+    prompt_len = inputs["input_ids"].shape[1]
+    new_tokens = output[:, prompt_len:]
+    with _tokenizer_lock:
+        decoded = processor.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+    return [text.strip() for text in decoded]
+
+
+# Prepare a batch of (page, cache_path, image, text_input) for the backend (runs in stage 2)
+def prepare_batch(batch):
+    if BACKEND == "vllm":
+        # vLLM does its own tokenization and image preprocessing
+        return [{"prompt": text_input, "multi_modal_data": {"image": image}} for _, _, image, text_input in batch]
+    return to_gpu_async(tokenize_batch(batch))
+
+
+# Run the backend on a prepared batch and return the raw outputs (runs in stage 3)
+def generate_batch(prepared, max_new_tokens):
+    if BACKEND == "vllm":
+        outputs = llm.generate(prepared, SamplingParams(max_tokens=max_new_tokens, temperature=0.0), use_tqdm=False)
+        return [output.outputs[0].text.strip() for output in outputs]
+    return generate_batch_hf(*prepared, max_new_tokens)
+
+
+def parse_page_output(raw_page_output):
+    try:
+        page_data = orjson.loads(raw_page_output) if ORJSON_AVAILABLE else json.loads(raw_page_output)
+    except ValueError:  # orjson.JSONDecodeError and json.JSONDecodeError are both ValueError
+        return raw_page_output
+    page_text = page_data.get("natural_text", "") if isinstance(page_data, dict) else None
+    if not isinstance(page_text, str):
+        return raw_page_output
+    return page_text.strip()
+
+
+# Rendering and anchor extraction are pure CPU work: pages are spread over a process pool
+RENDER_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+RENDER_IN_FLIGHT = RENDER_WORKERS + RENDER_QUEUE_SIZE  # pages submitted but not yet handed to stage 2
+_render_pool = None
+
+
+def get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        if "fork" in multiprocessing.get_all_start_methods():
+            # fork, not spawn: a spawned worker would re-run this script and load the model again
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("fork"))
+            # Fork the workers now, before the pipeline threads are started
+            _render_pool.submit(os.getpid).result()
+        else:
+            _render_pool = ThreadPoolExecutor(max_workers=1)
+    return _render_pool
+
+
+# Runs in a worker process: render one page and extract its anchor text
+def render_page(pdf_path, page_number, target_longest_image_dim):
+    image = render_page_image(pdf_path, page_number, target_longest_image_dim)
+    anchor_text = get_page_anchor_text(pdf_path, page_number)
+    return image, anchor_text
+
+
+# Collects the page texts of several PDFs as they arrive from any stage, in any order,
+# and hands each PDF to on_pdf_done(pdf_path, full_text) as soon as its last page is in
+class PageCollector:
+    def __init__(self, num_pages, on_pdf_done):
+        self.num_pages = num_pages  # {pdf_path: number of pages}
+        self.on_pdf_done = on_pdf_done
+        self.page_texts = {pdf_path: [None] * n for pdf_path, n in num_pages.items()}
+        self.missing = dict(num_pages)  # pages still expected per PDF
+        self.lock = threading.Lock()
+
+    def set(self, page, text):
+        pdf_path, page_number = page
+        with self.lock:
+            self.page_texts[pdf_path][page_number - 1] = text
+            self.missing[pdf_path] -= 1
+            if self.missing[pdf_path]:
+                return
+            page_texts = self.page_texts.pop(pdf_path)
+        # One join at the end instead of growing a string page after page
+        full_text = "".join(f"{page_text}\n\n" for page_text in page_texts)
+        self.on_pdf_done(pdf_path, full_text)
+
+    def error(self, page, e):
+        pdf_path, page_number = page
+        print(f"[{datetime.now()}] Error on page {page_number} of {pdf_path}: {e}")
+        self.set(page, f"[Error on page {page_number}]")
+
+
+def describe_pages(pages):
+    return ", ".join(f"{os.path.basename(pdf_path)} p.{page_number}" for pdf_path, page_number in pages)
+
+
+# Stage 1: render the pages in the pool and pass them on as they complete (in any order)
+def render_stage(pages, target_longest_image_dim, render_q, collector):
+    pool = get_render_pool()
+    pages = iter(pages)
+    pending = {}
+    try:
+        while True:
+            while len(pending) < RENDER_IN_FLIGHT and (page := next(pages, None)) is not None:
+                pending[pool.submit(render_page, *page, target_longest_image_dim)] = page
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = pending.pop(future)
+                try:
+                    render_q.put((page, *future.result()))
+                except Exception as e:
+                    collector.error(page, e)
+    finally:
+        for future in pending:
+            future.cancel()
+        render_q.put(_DONE)
+
+
+# Stage 2: answer pages from the cache, or build their prompts, tokenize them in batches
+# of batch_size pages (from any PDF) and start the GPU copy
+def prompt_stage(batch_size, max_new_tokens, use_cache, render_q, infer_q, collector):
+    batch = []
+    try:
+        while True:
+            item = render_q.get()
+            if item is not _DONE:
+                page, image, anchor_text = item
+                try:
+                    cache_path = page_cache_path(image, anchor_text, max_new_tokens) if use_cache else None
+                    cached = load_cached_output(cache_path)
+                    if cached is not None:
+                        print(f"[{datetime.now()}] Page {describe_pages([page])} loaded from cache.")
+                        collector.set(page, parse_page_output(cached))
+                    else:
+                        batch.append((page, cache_path, image, build_text_input(anchor_text)))
+                except Exception as e:
+                    collector.error(page, e)
+            if batch and (len(batch) == batch_size or item is _DONE):
+                pages = [page for page, _, _, _ in batch]
+                cache_paths = [cache_path for _, cache_path, _, _ in batch]
+                try:
+                    infer_q.put((pages, cache_paths, prepare_batch(batch)))
+                except Exception as e:
+                    for page in pages:
+                        collector.error(page, e)
+                batch = []
+            if item is _DONE:
+                break
+    finally:
+        infer_q.put(_DONE)
+
+
+def count_pages(pdf_path):
     reader = PdfReader(pdf_path)
     num_pages = len(reader.pages)
     print(f"[{datetime.now()}] The PDF '{os.path.basename(pdf_path)}' contains {num_pages} pages.")
-    
-    full_text = ""
-    for page_number in range(1, num_pages + 1):
-        start_page = time.time()
+    return num_pages
+
+
+# Process all pages of several PDFs, batching pages of different PDFs together.
+# Stage 3, the GPU, runs in the calling thread; on_pdf_done(pdf_path, full_text) is called per PDF.
+def process_pdfs(num_pages, on_pdf_done, max_new_tokens, target_longest_image_dim, batch_size=1, use_cache=True):
+    collector = PageCollector(num_pages, on_pdf_done)
+    for pdf_path, n in num_pages.items():
+        if n == 0:
+            on_pdf_done(pdf_path, "")
+    pages = [(pdf_path, page_number) for pdf_path, n in num_pages.items() for page_number in range(1, n + 1)]
+
+    get_render_pool()
+    render_q = queue.Queue(maxsize=RENDER_QUEUE_SIZE)
+    infer_q = queue.Queue(maxsize=INFER_QUEUE_SIZE)
+    stages = [
+        threading.Thread(target=render_stage, daemon=True,
+                         args=(pages, target_longest_image_dim, render_q, collector)),
+        threading.Thread(target=prompt_stage, daemon=True,
+                         args=(batch_size, max_new_tokens, use_cache, render_q, infer_q, collector)),
+    ]
+    for stage in stages:
+        stage.start()
+
+    while (item := infer_q.get()) is not _DONE:
+        pages, cache_paths, prepared = item
+        start_batch = time.time()
         try:
-            image_b64 = render_pdf_to_base64png(pdf_path, page_number, target_longest_image_dim=target_longest_image_dim)
-            anchor_text = get_anchor_text(pdf_path, page_number, pdf_engine="pdfreport", target_length=4000)
-            prompt = build_finetuning_prompt(anchor_text)
-            messages = [{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}}
-                ]
-            }]
-            text_input = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-            image = Image.open(BytesIO(base64.b64decode(image_b64)))
-            inputs = processor(text=[text_input], images=[image], padding=True, return_tensors="pt").to("cuda")
-            output = model.generate(**inputs, temperature=0.8, max_new_tokens=max_new_tokens, num_return_sequences=1, do_sample=True)
-            prompt_len = inputs["input_ids"].shape[1]
-            new_tokens = output[:, prompt_len:]
-            raw_page_output = processor.tokenizer.decode(new_tokens[0], skip_special_tokens=True).strip()
-            
-            try:
-                page_data = json.loads(raw_page_output)
-                page_text = page_data.get("natural_text", "").strip()
-            except Exception as e:
-                page_text = raw_page_output
-            
-            full_text += page_text + "\n\n"
-            end_page = time.time()
-            print(f"[{datetime.now()}] Page {page_number} processed in {end_page - start_page:.2f} seconds.")
+            raw_outputs = generate_batch(prepared, max_new_tokens)
         except Exception as e:
-            print(f"[{datetime.now()}] Error on page {page_number} of {pdf_path}: {e}")
-            full_text += f"[Error on page {page_number}]\n\n"
-    return full_text
+            for page in pages:
+                collector.error(page, e)
+            continue
+        end_batch = time.time()
+        print(f"[{datetime.now()}] Pages [{describe_pages(pages)}] processed in {end_batch - start_batch:.2f} seconds.")
+        for page, cache_path, raw_page_output in zip(pages, cache_paths, raw_outputs):
+            store_cached_output(cache_path, raw_page_output)
+            collector.set(page, parse_page_output(raw_page_output))
+    for stage in stages:
+        stage.join()
+
+
+# Process all pages in a PDF
+def process_pdf_allpages(pdf_path, max_new_tokens, target_longest_image_dim, batch_size=1, use_cache=True):
+    texts = {}
+    process_pdfs({pdf_path: count_pages(pdf_path)}, texts.__setitem__,
+                 max_new_tokens, target_longest_image_dim, batch_size, use_cache)
+    return texts[pdf_path]
 
 
 # Processing functions: single PDF and batch
 
 def process_single_pdf(pdf_path, output_dir, config):
-    extracted_text = process_pdf_allpages(pdf_path, config['max_new_tokens'], config['target_longest_image_dim'])
+    extracted_text = process_pdf_allpages(pdf_path, config['max_new_tokens'], config['target_longest_image_dim'], config['batch_size'], config['use_cache'])
     pdf_basename = os.path.splitext(os.path.basename(pdf_path))[0]
     output_text_path = os.path.join(output_dir, f"{pdf_basename}_clean_output.txt")
     with open(output_text_path, "w", encoding="utf-8") as f:
@@ -102,16 +544,24 @@ def process_batch(input_dir, output_dir, config):
     os.makedirs(output_dir, exist_ok=True)
     pdf_files = glob.glob(os.path.join(input_dir, "*.pdf"))
     print(f"[{datetime.now()}] Found {len(pdf_files)} PDF files in {input_dir}.")
+    start_batch = time.time()
+
+    num_pages = {}
     for pdf_file in pdf_files:
-        print(f"[{datetime.now()}] Processing: {pdf_file}")
-        start_file = time.time()
-        extracted_text = process_pdf_allpages(pdf_file, config['max_new_tokens'], config['target_longest_image_dim'])
+        try:
+            num_pages[pdf_file] = count_pages(pdf_file)
+        except Exception as e:
+            print(f"[{datetime.now()}] Cannot read {pdf_file}, skipped: {e}")
+
+    # Pages of all PDFs share the model batches; each file is written as soon as it is complete
+    def save_text(pdf_file, extracted_text):
         pdf_basename = os.path.splitext(os.path.basename(pdf_file))[0]
         out_file = os.path.join(output_dir, f"{pdf_basename}_clean_output.txt")
         with open(out_file, "w", encoding="utf-8") as f_out:
             f_out.write(extracted_text)
-        end_file = time.time()
-        print(f"[{datetime.now()}] Extracted text saved to: {out_file}. Time taken: {end_file - start_file:.2f} seconds.\n")
+        print(f"[{datetime.now()}] Extracted text saved to: {out_file}. Time elapsed: {time.time() - start_batch:.2f} seconds.\n")
+
+    process_pdfs(num_pages, save_text, config['max_new_tokens'], config['target_longest_image_dim'], config['batch_size'], config['use_cache'])
 
 
 # Main
@@ -4,23 +4,24 @@ import threading
 import os
 import re
 from typing import List, Dict, Optional
-from PIL import Image
 import tkinter.messagebox
 import tkinter.filedialog
 from functools import partial
 from datetime import datetime
 
-# Import the downloader which now handles both search and download
-try:
-    from download_fulltext import EnhancedFullTextDownloader
-    DOWNLOADER_AVAILABLE = True
-except ImportError as e:
-    print(f"❌ CRITICAL ERROR: Could not import 'download_fulltext.py'. Make sure the file is present. Details: {e}")
-    DOWNLOADER_AVAILABLE = False
-
 ctk.set_default_color_theme("dark-blue")
 ctk.set_appearance_mode("system")
 ABSTRACT_TRUNCATE_LENGTH = 250
+TITLE_TRUNCATE_LENGTH = 160
+# The results list only builds CARD_POOL_SIZE cards and re-binds them to the rows in view while
+# scrolling; cards have a fixed height so the number of rows in view follows from the list height.
+CARD_HEIGHT = 170
+CARD_SPACING = 10
+CARD_POOL_SIZE = 20
+DEBOUNCE_MS = 150  # delay before reacting to a burst of keystrokes / checkbox toggles
+
+def truncate(text: str, length: int) -> str:
+    return text if len(text) <= length else text[:length].rstrip() + "…"
 
 class ModernPARSALApp(ctk.CTk):
     """
@@ -35,8 +36,12 @@ class ModernPARSALApp(ctk.CTk):
         self.geometry("1400x900")
         self.minsize(1200, 700)
 
-        # Ensure the downloader backend is available before proceeding
-        if not DOWNLOADER_AVAILABLE:
+        # Import the downloader (search and download backend) only now: it pulls in
+        # aiohttp, lxml, PyMuPDF, ... which are not needed until the window exists
+        try:
+            from download_fulltext import EnhancedFullTextDownloader
+        except ImportError as e:
+            print(f"❌ CRITICAL ERROR: Could not import 'download_fulltext.py'. Make sure the file is present. Details: {e}")
             tkinter.messagebox.showerror("Downloader Error", "The file 'download_fulltext.py' was not found or contains errors. The application will close.")
             self.after(100, self.destroy)
             return
@@ -51,7 +56,11 @@ class ModernPARSALApp(ctk.CTk):
         self.results_count_var = ctk.StringVar(value="Ready to search")
         self.current_results = []
         self.article_selection_vars = {}
+        self._selection_traces = {}  # index -> trace id on article_selection_vars[index]
+        self.selected_indices = set()  # kept in sync by the variable traces, so counting is O(1)
+        self._syncing_select_all = False
         self.select_all_var = ctk.BooleanVar()
+        self._after_ids = {}  # pending debounced callbacks, by name
         
         self.load_logo()
         self.setup_widgets()
@@ -68,6 +77,7 @@ class ModernPARSALApp(ctk.CTk):
         try:
             logo_path = "chilab_logo.png"
             if os.path.exists(logo_path):
+                from PIL import Image  # only needed when the logo is there
                 img = Image.open(logo_path)
                 self.logo_image = ctk.CTkImage(light_image=img, dark_image=img, size=(50, 50))
                 print("ChiLab logo loaded.")
@@ -107,34 +117,64 @@ class ModernPARSALApp(ctk.CTk):
 
     def setup_bindings(self):
         """Sets up event listeners for real-time UI updates."""
-        self.keyword_var.trace_add('write', lambda *args: self.check_workflow_progress())
+        self.keyword_var.trace_add('write', lambda *args: self.debounce('progress', self.check_workflow_progress))
         self.keyword_entry.bind('<Return>', self.start_search)
         self.select_all_var.trace_add('write', self.on_select_all_change)
 
+    def debounce(self, name: str, callback):
+        """Runs callback DEBOUNCE_MS after the last call with the same name, once per burst."""
+        after_id = self._after_ids.pop(name, None)
+        if after_id:
+            self.after_cancel(after_id)
+        self._after_ids[name] = self.after(DEBOUNCE_MS, self._run_debounced, name, callback)
+
+    def _run_debounced(self, name: str, callback):
+        self._after_ids.pop(name, None)
+        callback()
+
+    def flush_debounced(self, name: str, callback):
+        """Runs a pending debounced callback immediately."""
+        after_id = self._after_ids.pop(name, None)
+        if after_id:
+            self.after_cancel(after_id)
+            callback()
+
     def on_select_all_change(self, *args):
         """Toggles selection for all articles currently displayed."""
+        if self._syncing_select_all:  # set by on_article_selection_change, not by the user
+            return
         is_checked = self.select_all_var.get()
         for var in self.article_selection_vars.values():
             var.set(is_checked)
         self.update_selection_display()
         
+    def on_article_toggle(self, index: int, var):
+        """Trace of each article's variable: updates the selected set, then the UI (debounced)."""
+        if var.get():
+            self.selected_indices.add(index)
+        else:
+            self.selected_indices.discard(index)
+        self.debounce('selection', self.on_article_selection_change)
+
     def on_article_selection_change(self, *args):
         """Updates the 'Select All' checkbox state based on individual selections."""
         self.update_selection_display()
         selected_count = self.get_selected_count()
         total_count = len(self.article_selection_vars)
         
-        # Handle indeterminate state of select_all checkbox
-        if 0 < selected_count < total_count:
-            if self.select_all_var.get(): self.select_all_var.set(False)
-        elif selected_count == total_count and total_count > 0:
-            if not self.select_all_var.get(): self.select_all_var.set(True)
-        elif selected_count == 0:
-             if self.select_all_var.get(): self.select_all_var.set(False)
+        # Handle indeterminate state of select_all checkbox (only its check mark: the
+        # articles themselves must not follow, or unchecking one would uncheck them all)
+        is_all = total_count > 0 and selected_count == total_count
+        if self.select_all_var.get() != is_all:
+            self._syncing_select_all = True
+            try:
+                self.select_all_var.set(is_all)
+            finally:
+                self._syncing_select_all = False
 
     def get_selected_count(self):
         """Returns the number of articles currently selected by the user."""
-        return sum(1 for var in self.article_selection_vars.values() if var.get())
+        return len(self.selected_indices)
 
     def update_selection_display(self):
         """Updates the label showing how many articles are found vs selected."""
@@ -145,6 +185,8 @@ class ModernPARSALApp(ctk.CTk):
 
     def start_search(self, event=None):
         """Triggered by the Search button or Enter key."""
+        # Enter right after typing: the button state may still be waiting for the debounce
+        self.flush_debounced('progress', self.check_workflow_progress)
         if self.search_button.cget("state") == "normal":
             self.search_articles()
 
@@ -316,10 +358,23 @@ class ModernPARSALApp(ctk.CTk):
         )
         self.download_button.grid(row=0, column=2, sticky="e", padx=(0, 10))
         
-        # Scrollable area for article cards
-        self.scrollable_frame = ctk.CTkScrollableFrame(results_container, corner_radius=8, fg_color=("gray92", "gray20"))
-        self.scrollable_frame.grid(row=1, column=0, sticky="nsew", padx=20, pady=(0, 20))
-        self.scrollable_frame.grid_columnconfigure(0, weight=1)
+        # Area for article cards: a virtual list. Only the pooled cards exist as widgets and the
+        # scrollbar moves the window of results they show, whatever the number of results.
+        self.results_list_frame = ctk.CTkFrame(results_container, corner_radius=8, fg_color=("gray92", "gray20"))
+        self.results_list_frame.grid(row=1, column=0, sticky="nsew", padx=20, pady=(0, 20))
+        self.results_list_frame.grid_rowconfigure(0, weight=1)
+        self.results_list_frame.grid_columnconfigure(0, weight=1)
+        self.scrollable_frame = ctk.CTkFrame(self.results_list_frame, fg_color="transparent")
+        self.scrollable_frame.grid(row=0, column=0, sticky="nsew", padx=(5, 0), pady=5)
+        self.results_scrollbar = ctk.CTkScrollbar(self.results_list_frame, command=self.on_results_scrollbar)
+        self.results_scrollbar.grid(row=0, column=1, sticky="ns", padx=(0, 3), pady=5)
+        
+        self.card_pool = []
+        self._window_start = 0
+        self._empty_state = None
+        self.scrollable_frame.bind("<Configure>", lambda event: self.render_results_window(self._window_start))
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.bind_all(sequence, self.on_results_mousewheel, add="+")
         
         # Bottom progress bar (initially hidden)
         self.progress_frame = ctk.CTkFrame(results_container, fg_color="transparent")
@@ -327,9 +382,18 @@ class ModernPARSALApp(ctk.CTk):
         self.progress_status_label = ctk.CTkLabel(self.progress_frame, text="", font=ctk.CTkFont(size=11))
 
     def update_results_display(self):
-        """Clears and rebuilds the article list in the UI."""
-        for widget in self.scrollable_frame.winfo_children(): widget.destroy()
+        """Binds the article list to the new results, reusing the pooled cards."""
+        if self._empty_state is not None:
+            self._empty_state.destroy()
+            self._empty_state = None
+        for card in self.card_pool:
+            card["frame"].pack_forget()
+        # Drop the traces of the previous results, or their closures keep the old variables alive
+        for i, trace_id in self._selection_traces.items():
+            self.article_selection_vars[i].trace_remove('write', trace_id)
+        self._selection_traces.clear()
         self.article_selection_vars.clear()
+        self.selected_indices.clear()
         self.select_all_var.set(False)
         
         if not self.current_results:
@@ -339,56 +403,130 @@ class ModernPARSALApp(ctk.CTk):
             ctk.CTkLabel(center_frame, text="📂", font=ctk.CTkFont(size=48)).pack(pady=(0, 10))
             ctk.CTkLabel(center_frame, text="No Articles Found", font=ctk.CTkFont(size=18, weight="bold")).pack()
             ctk.CTkLabel(center_frame, text="Try adjusting your search parameters.", font=ctk.CTkFont(size=12), text_color=("gray60", "gray40")).pack(pady=5)
+            self._empty_state = center_frame
         else:
-            # Render a card for each article
-            for i, article in enumerate(self.current_results): self.create_article_card(i, article)
-        
+            # One selection variable per article; widgets only for the rows in view
+            for i in range(len(self.current_results)):
+                selection_var = ctk.BooleanVar()
+                self._selection_traces[i] = selection_var.trace_add(
+                    'write', lambda *args, index=i, var=selection_var: self.on_article_toggle(index, var))
+                self.article_selection_vars[i] = selection_var
+            while len(self.card_pool) < min(CARD_POOL_SIZE, len(self.current_results)):
+                self.card_pool.append(self.create_article_card())
+        
+        self.render_results_window(0)
         self.update_selection_display()
 
-    def create_article_card(self, index: int, article: Dict):
+    def rows_in_view(self) -> int:
+        """Number of whole cards that fit in the results list at its current height."""
+        if not self.card_pool:
+            return 1
+        # reqheight is already scaled by customtkinter, like the spacing given to pack()
+        row_height = self.card_pool[0]["frame"].winfo_reqheight() * (CARD_HEIGHT + CARD_SPACING) / CARD_HEIGHT
+        return max(1, min(len(self.card_pool), int(self.scrollable_frame.winfo_height() // row_height)))
+
+    def render_results_window(self, start: int):
+        """Shows the results from position start in the pooled cards and updates the scrollbar."""
+        total_count = len(self.current_results)
+        rows = self.rows_in_view()
+        start = max(0, min(start, total_count - rows))
+        self._window_start = start
+        
+        for offset, card in enumerate(self.card_pool):
+            index = start + offset
+            if index < total_count:
+                self.update_card(card, index, self.current_results[index])
+                if not card["frame"].winfo_manager():
+                    card["frame"].pack(fill="x", pady=(0, CARD_SPACING), padx=5)
+            elif card["frame"].winfo_manager():
+                card["frame"].pack_forget()
+        
+        if total_count:
+            self.results_scrollbar.set(start / total_count, min(1.0, (start + rows) / total_count))
+        else:
+            self.results_scrollbar.set(0.0, 1.0)
+
+    def on_results_scrollbar(self, action, amount, unit=None):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units' | 'pages')."""
+        if action == "moveto":
+            start = round(float(amount) * len(self.current_results))
+        else:
+            step = int(float(amount)) * (self.rows_in_view() if unit == "pages" else 1)
+            start = self._window_start + step
+        if start != self._window_start:
+            self.render_results_window(start)
+
+    def on_results_mousewheel(self, event):
+        """Scrolls the results by one card per wheel step while the pointer is over the list."""
+        widget = self.winfo_containing(event.x_root, event.y_root)
+        # (the scrollbar handles its own wheel events)
+        if widget is None or not str(widget).startswith(str(self.scrollable_frame)):
+            return
+        step = -1 if (event.num == 4 or event.delta > 0) else 1
+        self.render_results_window(self._window_start + step)
+
+    def create_article_card(self) -> Dict:
         """
-        Creates a visual card representing a scientific article.
-        Includes title, authors, publisher, DOI, and abstract.
+        Creates an empty, fixed-height article card (title, authors, publisher, DOI
+        and abstract); update_card fills it with an article.
         """
-        selection_var = ctk.BooleanVar()
-        self.article_selection_vars[index] = selection_var
-        selection_var.trace_add('write', self.on_article_selection_change)
-        
-        card_frame = ctk.CTkFrame(self.scrollable_frame, corner_radius=8, fg_color=("white", "gray28"))
-        card_frame.pack(fill="x", pady=(0, 10), padx=5)
+        card_frame = ctk.CTkFrame(self.scrollable_frame, height=CARD_HEIGHT, corner_radius=8, fg_color=("white", "gray28"))
+        card_frame.pack_propagate(False)
         
         main_content = ctk.CTkFrame(card_frame, fg_color="transparent")
-        main_content.pack(fill="x", padx=15, pady=12)
+        main_content.pack(fill="both", expand=True, padx=15, pady=12)
         main_content.grid_columnconfigure(1, weight=1)
         
-        # Checkbox for selection
-        ctk.CTkCheckBox(main_content, text="", variable=selection_var, width=20).grid(row=0, column=0, rowspan=5, sticky="n", padx=(0, 15), pady=4)
+        card = {"frame": card_frame}
+        
+        # Checkbox for selection (its variable is swapped by update_card)
+        card["checkbox"] = ctk.CTkCheckBox(main_content, text="", width=20)
+        card["checkbox"].grid(row=0, column=0, rowspan=5, sticky="n", padx=(0, 15), pady=4)
         
         # Article Title
-        ctk.CTkLabel(main_content, text=article.get('title', 'N/A'), font=ctk.CTkFont(size=16, weight="bold"), wraplength=700, justify="left", anchor="w").grid(row=0, column=1, sticky="w")
+        card["title"] = ctk.CTkLabel(main_content, text="", font=ctk.CTkFont(size=16, weight="bold"), wraplength=700, justify="left", anchor="w")
+        card["title"].grid(row=0, column=1, sticky="w")
         
         # Year Badge
-        if article.get('year'):
-            ctk.CTkLabel(main_content, text=str(article.get('year')), font=ctk.CTkFont(size=11, weight="bold"), fg_color=("#E2E8F0", "#4A5568"), corner_radius=6, padx=8).grid(row=0, column=2, sticky="ne", padx=(10, 0), pady=2)
+        card["year"] = ctk.CTkLabel(main_content, text="", font=ctk.CTkFont(size=11, weight="bold"), fg_color=("#E2E8F0", "#4A5568"), corner_radius=6, padx=8)
+        card["year"].grid(row=0, column=2, sticky="ne", padx=(10, 0), pady=2)
         
         # Metadata (Authors, Publisher, DOI)
         meta_frame = ctk.CTkFrame(main_content, fg_color="transparent")
         meta_frame.grid(row=1, column=1, columnspan=2, sticky="w", pady=(8, 10))
+        card["authors"] = ctk.CTkLabel(meta_frame, text="", font=ctk.CTkFont(size=12))
+        card["authors"].pack(side="left")
+        card["publisher"] = ctk.CTkLabel(meta_frame, text="", font=ctk.CTkFont(size=12))
+        card["publisher"].pack(side="left", padx=5)
+        card["doi"] = ctk.CTkLabel(meta_frame, text="", font=ctk.CTkFont(size=12))
+        card["doi"].pack(side="left", padx=5)
         
-        authors = article.get('authors', [])
-        author_text = "Authors: " + (', '.join(authors[:3]) + (f", +{len(authors) - 3}" if len(authors) > 3 else "") if authors else "N/A")
-        ctk.CTkLabel(meta_frame, text=author_text, font=ctk.CTkFont(size=12)).pack(side="left")
+        # Snippet of the Abstract
+        card["abstract"] = ctk.CTkLabel(main_content, text="", font=ctk.CTkFont(size=12), wraplength=750, justify="left", anchor="w")
+        card["abstract"].grid(row=2, column=1, columnspan=2, sticky="ew", pady=(0, 5))
+        return card
+
+    def update_card(self, card: Dict, index: int, article: Dict):
+        """Re-binds a pooled card to the article at position index of the results."""
+        card["checkbox"].configure(variable=self.article_selection_vars[index])
+        card["title"].configure(text=truncate(article.get('title') or 'N/A', TITLE_TRUNCATE_LENGTH))
         
-        ctk.CTkLabel(meta_frame, text=f"•  Publisher: {article.get('editor', 'N/A')}", font=ctk.CTkFont(size=12)).pack(side="left", padx=5)
-        ctk.CTkLabel(meta_frame, text=f"•  DOI: {article.get('doi', 'N/A')}", font=ctk.CTkFont(size=12)).pack(side="left", padx=5)
+        if article.get('year'):
+            card["year"].configure(text=str(article.get('year')))
+            card["year"].grid()
+        else:
+            card["year"].grid_remove()
         
-        # Snippet of the Abstract
-        if article.get('abstract'):
-            ctk.CTkLabel(main_content, text=article.get('abstract'), font=ctk.CTkFont(size=12), wraplength=750, justify="left", anchor="w").grid(row=2, column=1, columnspan=2, sticky="ew", pady=(0, 5))
+        authors = article.get('authors', [])
+        author_text = "Authors: " + (', '.join(authors[:3]) + (f", +{len(authors) - 3}" if len(authors) > 3 else "") if authors else "N/A")
+        card["authors"].configure(text=author_text)
+        card["publisher"].configure(text=f"•  Publisher: {article.get('editor', 'N/A')}")
+        card["doi"].configure(text=f"•  DOI: {article.get('doi', 'N/A')}")
+        card["abstract"].configure(text=truncate(article.get('abstract') or '', ABSTRACT_TRUNCATE_LENGTH))
 
     def get_selected_articles(self) -> List[Dict]:
         """Filters the current results to return only those checked by the user."""
-        return [self.current_results[i] for i, var in self.article_selection_vars.items() if var.get()]
+        return [self.current_results[i] for i in sorted(self.selected_indices)]
 
     def start_download_process(self):
         """
@@ -448,17 +586,5 @@ def main():
     except Exception as e:
         print(f"Critical error: {e}")
 
-if __name__ == "__main__":
-    main()
-
-def main():
-    try:
-        print("🚀 Starting PARSAL...")
-        app = ModernPARSALApp()
-        if app.winfo_exists():
-             app.mainloop()
-    except Exception as e:
-        print(f"Critical error: {e}")
-
 if __name__ == "__main__":
     main()
\ No newline at end of file